@@ -25,6 +25,7 @@
     # always loaded
     'data': [
         'data/fuse_node.xml',
+        'data/fuse_cron.xml',
         'security/ir.model.access.csv',
         'views/views.xml',
         'views/templates.xml',
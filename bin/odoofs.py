@@ -8,16 +8,26 @@ import sys
 import errno
 import argparse
 import odoorpc
-from urllib.parse import urlparse
+from urllib.parse import urlparse, quote
+from urllib.error import HTTPError
+from http.client import HTTPException
+import json
+import hashlib
 from pathlib import Path
 from datetime import datetime
 from fusepy import FUSE, FuseOSError, Operations
 from stat import *
-from base64 import b64encode, b64decode
-import shelve
+import sqlite3
 import unittest
 import pathlib
 import math
+import threading
+import time
+import queue
+import functools
+import shutil
+import uuid
+from contextlib import contextmanager
 
 
 # ---- [Helpers] -----
@@ -26,6 +36,17 @@ def _now():
     return datetime.now().timestamp()
 
 
+def _path_locked(method):
+    """Run an OdooFS method holding the lock of its path, content of a file is changed by one thread at a time"""
+
+    @functools.wraps(method)
+    def locked(self, path, *args, **kwargs):
+        with self.attr.path_lock(path):
+            return method(self, path, *args, **kwargs)
+
+    return locked
+
+
 class FileMeta:
     # This needs to be compatible with fuse_node
 
@@ -39,7 +60,14 @@ class FileMeta:
     astime - Last attribute sync time
     size - File Size
     mode - File Model (Dir,File,Access rights)
-    errno - Error accessing the file, (used for referse cache)"""
+    errno - Error accessing the file, (used for referse cache)
+    ranges - Byte ranges [start, end] of the content present in the cache file, None when complete
+    checksum - Content hash reported by odoo
+    lchecksum - Content hash of the complete cache file"""
+
+    ranges = None
+    checksum = None
+    lchecksum = None
 
     def __init__(self, filename, errno=2, ctime=0, mtime=0, atime=0,
                  rctime=0, rmtime=0, size=0, mode=0, stime=0, astime=0):
@@ -75,6 +103,35 @@ class FileMeta:
         self.rctime = rattrs['st_ctime'] if rattrs else 0
         self.rmtime = rattrs['st_mtime'] if rattrs else 0
         self.astime = _now() if rattrs else 0
+        self.checksum = rattrs.get('checksum') if rattrs else None
+
+    def missing(self, start, end):
+        """Return the byte ranges between start and end that are not in the cache file"""
+        if self.ranges is None:
+            return []
+        gaps = []
+        pos = start
+        for rstart, rend in self.ranges:
+            if rend <= pos:
+                continue
+            if rstart >= end:
+                break
+            if rstart > pos:
+                gaps.append((pos, rstart))
+            pos = max(pos, rend)
+        if pos < end:
+            gaps.append((pos, end))
+        return gaps
+
+    def add_range(self, start, end):
+        """Mark the byte range as present in the cache file"""
+        merged = []
+        for rstart, rend in sorted((self.ranges or []) + [[start, end]]):
+            if merged and rstart <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], rend)
+            else:
+                merged.append([rstart, rend])
+        self.ranges = None if merged[0][0] <= 0 and merged[0][1] >= self.size else merged
 
     def touch(self):
         self.atime = _now()
@@ -87,49 +144,577 @@ class FileMeta:
         return _now() - self.astime
 
 
-# min,max - is based on access time cache timing will be kept in memory for open files.
+class MetaStore:
+    """FileMeta records stored in a SQLite database (WAL journal)
+
+    Behaves like a dict of path to FileMeta. Returned FileMeta objects are copies, they must be stored again after
+    they are changed. Only the rows in use are loaded so memory does not grow with the number of entries."""
+
+    columns = ('ctime', 'mtime', 'atime', 'rctime', 'rmtime', 'stime', 'astime', 'size', 'mode', 'errno', 'ranges',
+               'checksum', 'lchecksum')
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(str(filename), check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (path TEXT PRIMARY KEY, parent TEXT, ctime REAL, mtime REAL, '
+                        'atime REAL, rctime REAL, rmtime REAL, stime REAL, astime REAL, size INTEGER, mode INTEGER, '
+                        'errno INTEGER, ranges TEXT, checksum TEXT, lchecksum TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS meta_parent ON meta (parent)')
+
+    @staticmethod
+    def _prefix(path):
+        """Bounds of the paths below path, '0' is the character after '/'"""
+        path = str(path).rstrip('/')
+        return path + '/', path + '0'
+
+    def _row(self, fm):
+        path = str(fm.filename)
+        values = [getattr(fm, column) for column in self.columns]
+        values[self.columns.index('ranges')] = json.dumps(fm.ranges) if fm.ranges is not None else None
+        return [path, str(Path(path).parent)] + values
+
+    def _meta(self, row):
+        fm = FileMeta(row[0])
+        for column, value in zip(self.columns, row[2:]):
+            setattr(fm, column, value)
+        fm.ranges = json.loads(fm.ranges) if fm.ranges is not None else None
+        return fm
+
+    def get(self, path, default=None):
+        row = self.db.execute('SELECT * FROM meta WHERE path = ?', (str(path),)).fetchone()
+        return self._meta(row) if row else default
+
+    def get_many(self, paths):
+        """Return the stored FileMeta of paths as a dict"""
+        paths = [str(path) for path in paths]
+        result = {}
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            rows = self.db.execute(f'SELECT * FROM meta WHERE path IN ({",".join("?" * len(chunk))})', chunk)
+            result.update((row[0], self._meta(row)) for row in rows)
+        return result
+
+    def put_many(self, fms):
+        """Store FileMeta objects in one transaction"""
+        fms = list(fms)
+        if not fms:
+            return
+        placeholders = ','.join('?' * (len(self.columns) + 2))
+        with self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany(f'INSERT OR REPLACE INTO meta VALUES ({placeholders})', [self._row(fm) for fm in fms])
+
+    def under(self, path):
+        """Yield the FileMeta of path and everything below it"""
+        low, high = self._prefix(path)
+        rows = self.db.execute('SELECT * FROM meta WHERE path = ? OR (path >= ? AND path < ?)',
+                               (str(path), low, high)).fetchall()
+        for row in rows:
+            yield self._meta(row)
+
+    def update_under(self, path, **values):
+        """Set columns of path and everything below it in one statement"""
+        low, high = self._prefix(path)
+        assignments = ', '.join(f'{column} = ?' for column in values)
+        self.db.execute(f'UPDATE meta SET {assignments} WHERE path = ? OR (path >= ? AND path < ?)',
+                        list(values.values()) + [str(path), low, high])
+
+    def delete_under(self, path):
+        low, high = self._prefix(path)
+        self.db.execute('DELETE FROM meta WHERE path = ? OR (path >= ? AND path < ?)', (str(path), low, high))
+
+    def touch(self, path, resolution=60):
+        """Record an access of path, the access time is written at most once per resolution seconds"""
+        now = _now()
+        self.db.execute('UPDATE meta SET atime = ? WHERE path = ? AND atime < ?', (now, str(path), now - resolution))
+
+    def cached(self):
+        """Yield the FileMeta of paths with a cache file, least recently used first"""
+        rows = self.db.execute('SELECT * FROM meta WHERE stime > 0 ORDER BY atime').fetchall()
+        for row in rows:
+            yield self._meta(row)
+
+    def pop(self, path):
+        fm = self[path]
+        del self[path]
+        return fm
+
+    def __getitem__(self, path):
+        fm = self.get(path)
+        if fm is None:
+            raise KeyError(path)
+        return fm
+
+    def __setitem__(self, path, fm):
+        fm.filename = Path(str(path))
+        self.put_many([fm])
+
+    def __delitem__(self, path):
+        self.db.execute('DELETE FROM meta WHERE path = ?', (str(path),))
+
+    def __contains__(self, path):
+        return self.db.execute('SELECT 1 FROM meta WHERE path = ?', (str(path),)).fetchone() is not None
+
+    def __iter__(self):
+        return iter([row[0] for row in self.db.execute('SELECT path FROM meta')])
+
+    def __len__(self):
+        return self.db.execute('SELECT count(*) FROM meta').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+class BlobStore:
+    """Cache file content stored by checksum
+
+    The cache file of a path is a hard link to the blob of its content, paths with the same content share one blob.
+    A cache file is detached (copied) before it is changed so the blob keeps the content of its checksum."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        (self.root / 'tmp').mkdir(parents=True, exist_ok=True)
+
+    def path(self, checksum):
+        return self.root / checksum[:2] / checksum
+
+    def _tmp(self):
+        return self.root / 'tmp' / uuid.uuid4().hex
+
+    def __contains__(self, checksum):
+        return self.path(checksum).is_file()
+
+    def link(self, checksum, full_path):
+        """Make full_path a link of the blob, output: False if there is no blob"""
+        tmp = self._tmp()
+        try:
+            os.link(self.path(checksum), tmp)
+        except OSError:
+            return False
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp, full_path)
+        return True
+
+    def add(self, checksum, full_path):
+        """Store the complete cache file full_path, a duplicate of an existing blob is replaced by a link"""
+        blob = self.path(checksum)
+        if blob.is_file():
+            if not os.path.samefile(blob, full_path):
+                self.link(checksum, full_path)
+            return
+        blob.parent.mkdir(exist_ok=True)
+        try:
+            os.link(full_path, blob)
+        except FileExistsError:
+            self.link(checksum, full_path)
+        except OSError:
+            # No hard links on this file system, the cache works without sharing
+            pass
+
+    def detach(self, full_path, checksum=None):
+        """Give full_path its own copy of the content before it is changed, checksum is the content hash of
+        full_path"""
+        try:
+            if full_path.stat().st_nlink < 2:
+                return
+        except FileNotFoundError:
+            return
+        tmp = self._tmp()
+        shutil.copyfile(full_path, tmp)
+        os.replace(tmp, full_path)
+        self.release(checksum)
+
+    def unlink(self, full_path, checksum=None):
+        """Remove the cache file full_path, checksum is its content hash"""
+        if full_path.is_file():
+            full_path.unlink()
+            self.release(checksum)
+
+    def release(self, checksum):
+        """Remove the blob of checksum when no cache file links to it anymore"""
+        if not checksum:
+            return
+        blob = self.path(checksum)
+        try:
+            if blob.stat().st_nlink == 1:
+                blob.unlink()
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        """Remove the blobs no cache file links to"""
+        for blob in self.root.glob('??/*'):
+            if blob.stat().st_nlink == 1:
+                blob.unlink()
+
+
+class GetattrBatcher:
+    """Coalesces remote getattr calls into fuse.node.getattr_many
+
+    The first caller becomes the leader, waits window seconds for other threads to queue their paths and then
+    fetches the attributes of all queued paths in one call. Followers wait for the leader's result."""
+
+    class Slot:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self, fuse, window=0, max_batch=256):
+        self.fuse = fuse
+        self.window = window
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.leader = False
+
+    def _fetch(self, batch):
+        try:
+            for key, rattr in zip(batch, self.fuse.getattr_many(list(batch))):
+                batch[key].result = rattr
+        except Exception as e:
+            for queued in batch.values():
+                queued.error = e
+        for queued in batch.values():
+            queued.event.set()
+
+    def getattr(self, path):
+        path = str(path)
+        with self.lock:
+            slot = self.pending.get(path)
+            if not slot:
+                slot = self.pending[path] = self.Slot()
+            lead = not self.leader
+            self.leader = True
+        if lead:
+            if self.window:
+                time.sleep(self.window)
+            # Paths queued while a batch is fetched are picked up by the next round
+            while True:
+                with self.lock:
+                    if not self.pending:
+                        self.leader = False
+                        break
+                    batch = dict(list(self.pending.items())[:self.max_batch])
+                    for key in batch:
+                        del self.pending[key]
+                self._fetch(batch)
+        slot.event.wait()
+        if slot.error:
+            raise slot.error
+        return slot.result
+
+
+class SessionPool:
+    """Logged in odoo sessions, each session is used by one thread at a time"""
+
+    def __init__(self, odoo, config, size=1):
+        self.odoo = odoo
+        self.sessions = queue.Queue()
+        self.sessions.put(odoo)
+        for i in range(size - 1):
+            session = odoorpc.ODOO(host=config.server, port=config.port)
+            session.login(config.database, config.username, config.password)
+            self.sessions.put(session)
+
+    @contextmanager
+    def session(self):
+        odoo = self.sessions.get()
+        try:
+            yield odoo
+        finally:
+            self.sessions.put(odoo)
+
+    def http(self, url, data=None, headers=None):
+        with self.session() as odoo:
+            return odoo.http(url, data, headers)
+
+
+class PooledModel:
+    """Call the methods of an odoo model on a free session of the pool"""
+
+    def __init__(self, pool, model):
+        self.pool = pool
+        self.model = model
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            with self.pool.session() as odoo:
+                return getattr(odoo.env[self.model], method)(*args, **kwargs)
+
+        return call
+
+
+class OpQueue:
+    """Queue mkdir/create/unlink/rmdir operations and send them to odoo with fuse.node.batch"""
+
+    def __init__(self, fuse, size):
+        self.fuse = fuse
+        self.size = size
+        self.ops = []
+        self.lock = threading.Lock()
+
+    def add(self, *op):
+        """Queue an operation, the queue is submitted when it holds size operations"""
+        with self.lock:
+            self.ops.append(list(op))
+            full = len(self.ops) >= self.size
+        if full:
+            return self.submit()
+        return []
+
+    def submit(self, *op):
+        """Send the queued operations followed by op if given, output: list of (operation, errno) that failed"""
+        with self.lock:
+            ops, self.ops = self.ops, []
+        if op:
+            ops.append(list(op))
+        if not ops:
+            return []
+        return [(op, ierr) for op, ierr in zip(ops, self.fuse.batch(ops)) if ierr]
+
+
+# Attributes younger than min_refresh are served from the cache, older ones are served while they are fetched again
+# in the background and attributes older than max_timeout are fetched before they are returned. Missing paths are
+# remembered for negative_ttl seconds.
 class AttrCache:
-    def __init__(self, cache_dir, fuse, min_refresh=60, max_timeout=3600):
+    def __init__(self, cache_dir, fuse, min_refresh=60, max_timeout=3600, negative_ttl=5):
         self.cache_dir = Path(cache_dir)
         self.min_time = min_refresh
         self.max_time = max_timeout
-        self.meta = shelve.open(str(self.cache_dir / Path('.meta_cache')), writeback=True)
+        self.negative_time = negative_ttl
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.meta = MetaStore(self.cache_dir / Path('.meta_cache.db'))
+        self.blobs = BlobStore(self.cache_dir / Path('.blobs'))
+        # Number of open file handles per path, open files are not evicted
         self.filehandle = {}
         self.fuse = fuse
+        # The store connection is shared by the fuse threads, odoo is never called while the lock is held
+        self.lock = threading.RLock()
+        # Serialize content changes of the same file, paths are spread over a fixed number of locks
+        self.path_locks = [threading.RLock() for i in range(64)]
+        self.stale = set()
+        self.stale_event = threading.Event()
+        self.revalidator = None
+
+    def path_lock(self, path):
+        return self.path_locks[hash(str(path)) % len(self.path_locks)]
 
     def __setitem__(self, key, value):
-        self.meta[str(key)] = value
+        with self.lock:
+            self.meta[str(key)] = value
 
     def __getitem__(self, key):
         path = str(key)
-
-        if path not in self.meta:
-            attr = self.fuse.getattr(path)
-            if attr and path not in self.meta:
-                self.meta[path] = FileMeta(path, errno=attr['errno'], ctime=attr['st_ctime'], mtime=attr['st_mtime'],
-                                           atime=attr['st_atime'], mode=attr['st_mode'], size=attr['st_size'])
-            else:
-                self.meta[path] = FileMeta(path, errno=errno.ENOENT)
-
-        return self.meta[path]
+        with self.lock:
+            fm = self.meta.get(path)
+            state = self.state(fm)
+        if state == 'stale':
+            self.revalidate(path)
+        if state != 'expired':
+            return fm
+        return self._store(path, self.fuse.getattr(path))
+
+    def state(self, fm):
+        """output: 'fresh', 'stale' (usable while it is fetched again) or 'expired'"""
+        if fm is None or not fm.astime:
+            return 'expired'
+        age = fm.attr_age()
+        if fm.errno:
+            return 'fresh' if age < self.negative_time else 'expired'
+        if age < self.min_time:
+            return 'fresh'
+        if age < self.max_time:
+            return 'stale'
+        return 'expired'
+
+    def _store(self, path, attr):
+        with self.lock:
+            if attr:
+                return self.refresh(path, attr)
+            fm = FileMeta(path, errno=errno.ENOENT, astime=_now())
+            self.meta[path] = fm
+            return fm
+
+    def revalidate(self, path):
+        """Fetch the attributes of path again in the background"""
+        with self.lock:
+            self.stale.add(str(path))
+            if not self.revalidator:
+                self.revalidator = threading.Thread(target=self._revalidate, daemon=True)
+                self.revalidator.start()
+        self.stale_event.set()
+
+    def _revalidate(self):
+        while True:
+            self.stale_event.wait()
+            self.stale_event.clear()
+            with self.lock:
+                paths, self.stale = self.stale, set()
+            for path in paths:
+                try:
+                    self._store(path, self.fuse.getattr(path))
+                except Exception as e:
+                    # The entry stays stale and is tried again on the next access
+                    print(f'Refreshing {path} failed: {e}', file=sys.stderr)
+
+    def refresh(self, path, rattrs):
+        """Store the remote attributes of path, the local state of a cached file is kept"""
+        return self.refresh_many([(path, rattrs)])[0]
+
+    def refresh_many(self, entries):
+        """Store the remote attributes of a list of (path, attrs) with one read and one write of the store"""
+        with self.lock:
+            current = self.meta.get_many(path for path, rattrs in entries)
+            fms = [self._refresh(str(path), rattrs, current.get(str(path))) for path, rattrs in entries]
+            self.meta.put_many(fms)
+            return fms
+
+    def _refresh(self, path, rattrs, fm):
+        if fm is None or fm.errno:
+            fm = FileMeta(path, errno=rattrs['errno'], ctime=rattrs['st_ctime'], mtime=rattrs['st_mtime'],
+                          atime=rattrs['st_atime'])
+            fm.update(rattrs)
+        elif fm.mtime > fm.rmtime and not rattrs['errno']:
+            # Local changes that are not uploaded yet win
+            fm.astime = _now()
+        else:
+            fm.update(rattrs)
+        if rattrs.get('pending'):
+            # Size not known yet (report not rendered), fetched with getattr on the next access
+            fm.astime = 0
+        if fm.errno:
+            self.blobs.unlink(self.full_path(path), fm.lchecksum)
+        return fm
 
     def __delitem__(self, key):
-        del self.meta[str(key)]
+        with self.lock:
+            del self.meta[str(key)]
 
     def __iter__(self):
-        return iter(self.meta)
+        with self.lock:
+            return iter(self.meta)
 
     def __len__(self):
-        return len(self.meta)
+        with self.lock:
+            return len(self.meta)
 
     def __contains__(self, key):
-        return str(key) in self.meta
+        with self.lock:
+            return str(key) in self.meta
+
+    def invalidate(self, path):
+        """Mark the attributes of path and everything below it as stale, they are fetched again on the next
+        access. The cache files are kept so unchanged content (same checksum) is not downloaded again"""
+        with self.lock:
+            self.meta.update_under(str(path), astime=0)
+
+    def move(self, old, new):
+        """Move the cached attributes and content of old and everything below it to new, the attributes are
+        marked stale"""
+        old, new = str(old), str(new)
+        with self.lock:
+            moved = list(self.meta.under(old))
+            for fm in moved:
+                fm.filename = Path(new + str(fm.filename)[len(old):])
+                fm.astime = 0
+            self.meta.delete_under(old)
+            self.meta.put_many(moved)
+            full_path = self.full_path(old)
+            if full_path.exists():
+                new_path = self.full_path(new)
+                new_path.parent.mkdir(parents=True, exist_ok=True)
+                full_path.rename(new_path)
+
+    def checksum(self, path):
+        """Content hash of a cache file, same algorithm as the ir.attachment checksum"""
+        sha1 = hashlib.sha1()
+        with open(self.full_path(path), 'rb') as f:
+            for data in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(data)
+        return sha1.hexdigest()
+
+    def opened(self, path):
+        with self.lock:
+            self.filehandle[str(path)] = self.filehandle.get(str(path), 0) + 1
+            self.meta.touch(path)
+
+    def touch(self, path):
+        """Record an access of the cache file of path for the evictor"""
+        with self.lock:
+            self.meta.touch(path)
+
+    def released(self, path):
+        with self.lock:
+            count = self.filehandle.pop(str(path), 0) - 1
+            if count > 0:
+                self.filehandle[str(path)] = count
+
+    def is_open(self, path):
+        with self.lock:
+            return str(path) in self.filehandle
+
+    def evict(self, path):
+        """Remove the cache file of path unless it is open or has changes that are not uploaded
+        output: True if the file was removed"""
+        with self.path_lock(path), self.lock:
+            fm = self.meta.get(str(path))
+            if fm is None or not fm.stime or fm.mtime > fm.rmtime or str(path) in self.filehandle:
+                return False
+            self.blobs.unlink(self.full_path(path), fm.lchecksum)
+            fm.stime = 0
+            fm.ranges = None
+            fm.lchecksum = None
+            self.meta[str(path)] = fm
+            return True
+
+    def share(self, path):
+        """Store the complete cache file of path in the blob store"""
+        with self.path_lock(path):
+            fm = self.get(path)
+            if fm is not None and fm.ranges is None and fm.lchecksum and self.full_path(path).is_file():
+                self.blobs.add(fm.lchecksum, self.full_path(path))
+
+    def link(self, path, fm):
+        """Use the blob with the remote checksum of path as its cache file, no content is transferred
+        output: True if the blob existed"""
+        with self.path_lock(path):
+            if not fm.checksum or not self.blobs.link(fm.checksum, self.full_path(path)):
+                return False
+            if fm.lchecksum != fm.checksum:
+                # The link replaced the previous content of path
+                self.blobs.release(fm.lchecksum)
+            fm.ranges = None
+            fm.lchecksum = fm.checksum
+            fm.mtime = fm.rmtime
+            fm.stime = fm.atime = _now()
+            self[path] = fm
+            return True
+
+    def get(self, path):
+        """Stored FileMeta of path or None, nothing is fetched from odoo"""
+        with self.lock:
+            return self.meta.get(str(path))
+
+    def detach(self, path):
+        fm = self.get(path)
+        self.blobs.detach(self.full_path(path), fm.lchecksum if fm else None)
+
+    def discard(self, path):
+        """Remove the cache file of path before it is written again, a blob shared with other paths is kept"""
+        fm = self.get(path)
+        self.blobs.unlink(self.full_path(path), fm.lchecksum if fm else None)
 
     def cache_open(self, path, bin_object):
         full_path = self.full_path(path)
         os.makedirs(full_path.parent, mode=0o700, exist_ok=True)
+        self.discard(path)
         fh = open(full_path, "w+b")
-        self.meta[path].stime = _now()
+        with self.lock:
+            fm = self.meta[str(path)]
+            fm.stime = fm.atime = _now()
+            self.meta[str(path)] = fm
         fh.write(bin_object)
         fh.close()
 
@@ -139,42 +724,268 @@ class AttrCache:
         return full_path
 
 
+class CacheEvictor:
+    """Removes cache files not used for maxage days and the least recently used files while the cache is larger
+    than maxsize bytes. Open files and files with changes that are not uploaded are kept."""
+
+    def __init__(self, attr, maxage=0, maxsize=0, interval=60):
+        self.attr = attr
+        self.maxage = maxage
+        self.maxsize = maxsize
+        self.interval = interval
+        self.thread = None
+
+    def start(self):
+        if (self.maxage or self.maxsize) and not self.thread:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.evict()
+            except Exception as e:
+                print(f'Cache eviction failed: {e}', file=sys.stderr)
+            time.sleep(self.interval)
+
+    def evict(self):
+        """output: list of evicted paths"""
+        with self.attr.lock:
+            cached = list(self.attr.meta.cached())
+        entries = []
+        # Blocks allocated per inode, sparse files only count the downloaded parts and shared blobs count once
+        sizes = {}
+        links = {}
+        for fm in cached:
+            try:
+                stat = self.attr.full_path(fm.filename).stat()
+            except FileNotFoundError:
+                entries.append((fm, None))
+                continue
+            inode = (stat.st_dev, stat.st_ino)
+            sizes[inode] = stat.st_blocks * 512
+            links[inode] = links.get(inode, 0) + 1
+            entries.append((fm, inode))
+        total = sum(sizes.values())
+        expire = _now() - self.maxage * 86400
+        evicted = []
+        for fm, inode in entries:
+            if not (self.maxage and fm.atime < expire) and not (self.maxsize and total > self.maxsize):
+                break
+            if self.attr.evict(fm.filename):
+                evicted.append(str(fm.filename))
+                if inode:
+                    # Space is freed when the last cached path of the inode is evicted
+                    links[inode] -= 1
+                    if not links[inode]:
+                        total -= sizes[inode]
+        if evicted:
+            self.attr.blobs.prune()
+        return evicted
+
+
 class OdooFS(Operations):
 
     def __init__(self, config, odoo):
         self.odoo = odoo
         self.config = config
-        self.fuse = self.odoo.env['fuse.node']
-        self.attr = AttrCache(self.config.cache, self.fuse)
+        self.pool = SessionPool(odoo, config, self.config.sessions if self.config.threads else 1)
+        self.fuse = PooledModel(self.pool, 'fuse.node')
+        self.attr = AttrCache(self.config.cache, GetattrBatcher(self.fuse), self.config.min_refresh,
+                              self.config.max_timeout, self.config.negative_ttl)
+        self.changes = PooledModel(self.pool, 'fuse.change')
+        self.change_seq = self.changes.changes_since(0)['seq']
+        self.change_seen = []
+        self.change_poll = _now()
+        self.change_lock = threading.Lock()
+        self.queue = OpQueue(self.fuse, self.config.batch_size) if self.config.batch_size else None
+        self.evictor = CacheEvictor(self.attr, self.config.maxage, self.config.maxsize * 1024 * 1024)
 
     # Helpers
     # =======
 
+    def _poll_changes(self):
+        """Invalidate the paths changed on odoo, polls the change journal at most every poll_interval seconds"""
+        if _now() - self.change_poll < self.config.poll_interval:
+            return
+        # One thread polls, the others continue with the cache
+        if not self.change_lock.acquire(blocking=False):
+            return
+        try:
+            self.change_poll = _now()
+            while True:
+                changes = self.changes.changes_since(self.change_seq, self.change_seen)
+                if changes['reset']:
+                    self.attr.invalidate('/')
+                for path in changes['paths']:
+                    self.attr.invalidate(path)
+                self.change_seq, self.change_seen = changes['seq'], changes['seen']
+                if not changes['paths']:
+                    break
+        finally:
+            self.change_lock.release()
+
     def _full_path(self, path):
         full_path = self.attr.full_path(path)
         return full_path
 
+    def _queue(self, *op):
+        """Queue an operation when batching is enabled
+
+            The result is assumed to be success, operations that fail when the queue is submitted are reported on
+            stderr and their paths are fetched again from odoo.
+            output: True if the operation was queued
+        """
+        if not self.queue:
+            return False
+        self._failed(self.queue.add(*op))
+        return True
+
+    def _submit(self):
+        """Send queued operations before odoo is asked about their results"""
+        if self.queue:
+            self._failed(self.queue.submit())
+
+    def _failed(self, failed):
+        for op, ierr in failed:
+            print(f'{op[0]} {" ".join(op[1:])} failed: {os.strerror(ierr)}', file=sys.stderr)
+            for path in op[1:]:
+                self.attr.invalidate(path)
+
+    @_path_locked
     def _upload(self, path):
+        """Upload the cache file in chunk_size chunks over HTTP, an interrupted upload resumes at the
+        acknowledged offset"""
+        self._submit()
         full_path = self._full_path(path)
-        with open(full_path, 'rb') as f:
-            bin_data = b64encode(f.read())
-            self.odoo.env['fuse.node'].upload(str(path), bin_data.decode('utf-8'))
+        fm = self.attr[path]
+        size = full_path.stat().st_size
+        for attempt in range(self.config.upload_retries + 1):
+            try:
+                session = self.fuse.upload_begin(str(path), size, fm.mtime, fm.rmtime)
+                if session['errno']:
+                    raise FuseOSError(session['errno'])
+                offset = session['offset']
+                with open(full_path, 'rb') as f:
+                    while offset < size:
+                        f.seek(offset)
+                        response = self.pool.http(f"fuse/upload/{session['token']}?offset={offset}",
+                                                  data=f.read(self.config.chunk_size),
+                                                  headers={'Content-Type': 'application/octet-stream'})
+                        with response:
+                            result = json.loads(response.read())
+                        if result['errno'] and result['errno'] != errno.EINVAL:
+                            raise FuseOSError(result['errno'])
+                        offset = result['offset']
+                ierrno = self.fuse.upload_commit(session['token'])
+                if ierrno:
+                    raise FuseOSError(ierrno)
+                break
+            except FuseOSError:
+                raise
+            except (OSError, HTTPException):
+                if attempt == self.config.upload_retries:
+                    raise FuseOSError(errno.EIO)
+                time.sleep(2 ** attempt)
+        fm = self.attr[path]
+        fm.rmtime = fm.mtime
+        fm.lchecksum = self.attr.checksum(path)
+        self.attr[path] = fm
+        self.attr.share(path)
+
+    def _http_content(self, path, start=None, end=None):
+        """Fetch raw file content over HTTP, returns (complete, data), complete is True if the server
+        returned the whole file instead of the range"""
+        headers = {}
+        if start is not None:
+            headers['Range'] = f'bytes={start}-{end - 1}'
+        try:
+            response = self.pool.http('fuse/content' + quote(str(path)), headers=headers)
+        except HTTPError as e:
+            if e.code == 404:
+                return True, b''
+            if e.code == 416:
+                return False, b''
+            raise
+        with response:
+            return response.status != 206, response.read()
 
     def _download(self, path):
-        bin_data = self.fuse.download(path)
-        if bin_data:
-            self.attr.cache_open(path, b64decode(bin_data))
-        else:
-            self.attr.cache_open(path, b'')
+        """Download the whole file, used when the size of the file is not known"""
+        complete, bin_data = self._http_content(path)
+        self.attr.cache_open(path, bin_data)
+        fm = self.attr[path]
+        fm.ranges = None
+        fm.lchecksum = hashlib.sha1(bin_data).hexdigest()
+        # The cache file holds the remote version now
+        fm.mtime = fm.rmtime
+        if not fm.size:
+            fm.size = self._full_path(path).stat().st_size
+        self.attr[path] = fm
+        self.attr.share(path)
+
+    @_path_locked
+    def _prepare(self, path):
+        """Create a sparse cache file, the content is fetched by _fetch when it is read"""
+        fm = self.attr[path]
+        if not fm.size:
+            self._download(path)
+            return
+        full_path = self._full_path(path)
+        os.makedirs(full_path.parent, mode=0o700, exist_ok=True)
+        self.attr.discard(path)
+        with open(full_path, 'wb') as f:
+            f.truncate(fm.size)
+        fm.ranges = []
+        fm.lchecksum = None
+        fm.mtime = fm.rmtime
+        fm.stime = fm.atime = _now()
+        self.attr[path] = fm
+
+    @_path_locked
+    def _fetch(self, path, offset, length):
+        """Make sure a byte range is in the cache file, missing parts are downloaded in chunk_size blocks"""
+        fm = self.attr[path]
+        chunk = self.config.chunk_size
+        start = offset // chunk * chunk
+        end = min(fm.size, -(-(offset + length) // chunk) * chunk)
+        gaps = fm.missing(start, end)
+        if not gaps:
+            return
+        with open(self._full_path(path), 'r+b') as f:
+            for gap_start, gap_end in gaps:
+                complete, bin_data = self._http_content(path, gap_start, gap_end)
+                if complete:
+                    f.seek(0)
+                    f.write(bin_data)
+                    f.truncate(len(bin_data))
+                    fm.ranges = None
+                    fm.size = len(bin_data)
+                    break
+                f.seek(gap_start)
+                f.write(bin_data)
+                fm.add_range(gap_start, gap_end)
+        if fm.ranges is None:
+            fm.lchecksum = self.attr.checksum(path)
+        self.attr[path] = fm
+        if fm.ranges is None:
+            self.attr.share(path)
 
     # Filesystem methods
     # ==================
 
+    def init(self, path):
+        """Preload the attributes of the static node tree at mount"""
+        self.attr.refresh_many([(entry['path'], entry) for entry in self.fuse.skeleton()])
+        self.evictor.start()
+
     # TODO: Check if mode is same as on odoo if not return error
     def chmod(self, path, mode):
         if self.attr[path]:
-            self.attr[path].mode = mode
-            error = self.attr[path].errno
+            fm = self.attr[path]
+            fm.mode = mode
+            self.attr[path] = fm
+            error = fm.errno
         if not self.attr[path]:
             error = errno.ENOENT
         if error:
@@ -195,17 +1006,10 @@ class OdooFS(Operations):
         Returns the file information Works by checking if file have been synced if so return file information
         If file have not been sync check if attributes have been sync return synced attributes or sync if necessary
         """
+        self._poll_changes()
 
-        if path in self.attr:
-            meta1 = self.attr[path]
-        else:
-            rattr = self.fuse.getattr(path)
-            meta1 = FileMeta(path, mode=rattr['st_mode'], ctime=rattr['st_ctime'], mtime=rattr['st_mtime'],
-                             atime=rattr['st_atime'], size=rattr['st_size'], errno=rattr['errno'])
-
-        if not meta1:
-            raise FuseOSError(errno.NOENT)
-        elif meta1.errno != 0:
+        meta1 = self.attr[path]
+        if meta1.errno != 0:
             raise FuseOSError(meta1.errno)
 
         oattr = {'st_uid': self.config.uid,
@@ -221,16 +1025,20 @@ class OdooFS(Operations):
         return oattr
 
     def readdir(self, path, fh):
-        fuse_errno, dirents = self.fuse.readdir(path)
-        if fuse_errno != 0:
-            raise FuseOSError(fuse_errno)
-        for entry in dirents:
-            fm = FileMeta(filename=Path(path) / Path(entry['filename']), mode=entry['st_mode'], atime=entry['st_atime'],
-                          mtime=entry['st_mtime'], ctime=entry['st_ctime'], size=entry['st_size'], errno=entry['errno'])
-            self.attr[fm.filename] = fm
-
-        for r in dirents:
-            yield r['filename']
+        """Streams the directory entries page by page so memory stays bounded for huge directories"""
+        self._submit()
+        self._poll_changes()
+        cursor = False
+        while True:
+            fuse_errno, dirents, cursor = self.fuse.readdir_page(path, cursor, self.config.page_size)
+            if fuse_errno != 0:
+                raise FuseOSError(fuse_errno)
+            self.attr.refresh_many([(Path(path) / Path(entry['filename']), entry) for entry in dirents
+                                    if entry['filename'] not in ('.', '..')])
+            for entry in dirents:
+                yield entry['filename']
+            if not cursor:
+                break
 
     def readlink(self, path):
         raise FuseOSError(errno.ENOSYS)
@@ -242,16 +1050,24 @@ class OdooFS(Operations):
     # TODO: Remove object from odoo
     # TODO: If a path without object then create path in odoo
     def rmdir(self, path):
-        errno = self.fuse.rmdir(path)
-        if errno:
-            raise FuseOSError(errno)
+        if not self._queue('rmdir', path):
+            ierr = self.fuse.rmdir(path)
+            if ierr:
+                raise FuseOSError(ierr)
+        self.attr[path] = FileMeta(path, errno=errno.ENOENT, astime=_now())
 
     # TODO: Create object on odoo
     # TODO: If a path without object then create path in odoo
     def mkdir(self, path, mode):
-        errno = self.fuse.mkdir(path)
-        if errno:
-            raise FuseOSError(errno)
+        if self._queue('mkdir', path):
+            self.attr[path] = FileMeta(path, errno=0, ctime=_now(), mtime=_now(), atime=_now(), size=1024,
+                                       mode=S_IFDIR | S_IXUSR | S_IXGRP | S_IRUSR | S_IRGRP, astime=_now())
+            return
+        ierr = self.fuse.mkdir(path)
+        if ierr:
+            raise FuseOSError(ierr)
+        # The lookup before mkdir cached the path as missing
+        self.attr.invalidate(path)
 
     def statfs(self, path):
         """
@@ -269,9 +1085,12 @@ class OdooFS(Operations):
 
     # TODO: Remove object or attachment in odoo
     def unlink(self, path):
-        errno = self.fuse.unlink(path)
-        if errno:
-            raise FuseOSError(errno)
+        if not self._queue('unlink', path):
+            ierr = self.fuse.fs_unlink(path)
+            if ierr:
+                raise FuseOSError(ierr)
+        self.attr.discard(path)
+        self.attr[path] = FileMeta(path, errno=errno.ENOENT, astime=_now())
 
     # TODO: Create symlink in cache? Can it be translated to Odoo
     def symlink(self, name, target):
@@ -279,9 +1098,17 @@ class OdooFS(Operations):
 
     # TODO: Rename field in odoo if possible.
     def rename(self, old, new):
-        errno = self.fuse.rename(old, new)
-        if errno:
-            raise FuseOSError(errno)
+        if self.queue:
+            # The rename is sent with the queued operations, the new name is only known after the rename
+            failed = self.queue.submit('rename', old, new)
+            ierr = failed[-1][1] if failed and failed[-1][0] == ['rename', old, new] else 0
+            self._failed(failed[:-1] if ierr else failed)
+        else:
+            ierr = self.fuse.rename(old, new)
+        if ierr:
+            raise FuseOSError(ierr)
+        # The record moved on odoo, the cached content moves with it instead of being downloaded again
+        self.attr.move(old, new)
 
     # TODO: Hardlink? Not Supported or supported in cache
     def link(self, target, name):
@@ -294,35 +1121,62 @@ class OdooFS(Operations):
     # File methods
     # ============
 
+    @_path_locked
     def open(self, path, flags):
         """Takes path and flags and open a file in the local cache
         if file does not exists or is not updated download from odoo first"""
+        self._poll_changes()
 
         fm = self.attr[path]
 
         # Retrieve meta data
+        if fm.errno == 0 and S_ISREG(fm.mode) and flags & (os.O_WRONLY | os.O_RDWR) and not fm.mode & S_IWUSR:
+            raise FuseOSError(errno.EACCES)
         if fm.errno == 0 and S_ISREG(fm.mode):
             if fm.mtime < fm.rmtime or not self._full_path(path).exists():
-                self._download(path)
-                self.attr[path].stime = _now()
+                if self._full_path(path).exists() and fm.checksum and fm.checksum == fm.lchecksum:
+                    # Record changed but the content is the same, only the metadata is updated
+                    fm.mtime = fm.rmtime
+                    self.attr[path] = fm
+                elif not self.attr.link(path, fm):
+                    self._prepare(path)
+            fm = self.attr[path]
+            if flags & (os.O_WRONLY | os.O_RDWR):
+                # Changes must not reach the blob shared with other paths
+                self.attr.detach(path)
+            if flags & os.O_TRUNC:
+                fm.ranges = None
+                self.attr[path] = fm
+            elif flags & (os.O_WRONLY | os.O_RDWR):
+                # Local changes are uploaded as a whole file
+                self._fetch(path, 0, fm.size)
         elif fm.errno == 0 and S_ISDIR(fm.mode):
             raise FuseOSError(errno.EISDIR)
         else:
             raise FuseOSError(fm.errno)
         fh = os.open(self._full_path(path), flags)
+        self.attr.opened(path)
         return fh
 
     def create(self, path, mode, fi=None):
         # TODO: Check permissions and return appropriate error
-        ierrno = self.odoo.env['fuse.node'].file_create(path)
+        if self._queue('create', path):
+            ierrno = 0
+            self.attr[path] = FileMeta(path, errno=0, ctime=_now(), mtime=_now(), atime=_now(), rmtime=_now(),
+                                       astime=_now())
+        else:
+            ierrno = self.fuse.file_create(path)
         if ierrno == 0:
             full_path = self._full_path(path)
+            self.attr.discard(path)
             fh = os.open(full_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o700)
-            self.attr[path].file_name = path
-            self.attr[path].ctime = _now()
-            self.attr[path].size = 0
-            self.attr[path].errno = ierrno
-            self.attr[path].mode = mode | S_IFREG
+            self.attr.opened(path)
+            fm = self.attr[path]
+            fm.ctime = fm.stime = _now()
+            fm.size = 0
+            fm.errno = ierrno
+            fm.mode = mode | S_IFREG
+            self.attr[path] = fm
             return fh
         else:
             raise FuseOSError(ierrno)
@@ -331,9 +1185,11 @@ class OdooFS(Operations):
         # TODO: Check file permissions and return appropriate error messages
 
         fm = self.attr[path]
-        fm.atime = _now()
         if not fm.mode & S_IRUSR:
             raise FuseOSError(errno=errno.EACCES)
+        if offset < fm.size:
+            self._fetch(path, offset, length)
+        self.attr.touch(path)
         os.lseek(fh, offset, os.SEEK_SET)
         return os.read(fh, length)
 
@@ -341,15 +1197,20 @@ class OdooFS(Operations):
     def write(self, path, buf, offset, fh):
         fm = self.attr[path]
         fm.mtime = _now()
+        fm.lchecksum = None
         self.attr[path] = fm
         os.lseek(fh, offset, os.SEEK_SET)
         return os.write(fh, buf)
 
     # TODO: Translate to odoo
+    @_path_locked
     def truncate(self, path, length, fh=None):
         full_path = self._full_path(path)
+        self._fetch(path, 0, self.attr[path].size)
+        self.attr.detach(path)
         fm = self.attr[path]
         fm.mtime = _now()
+        fm.lchecksum = None
         self.attr[path] = fm
         with open(full_path, 'r+') as f:
             f.truncate(length)
@@ -373,6 +1234,7 @@ class OdooFS(Operations):
         fm = self.attr[path]
         if fm.mtime > fm.rmtime:
             self._upload(path)
+        self.attr.released(path)
         return ret1
 
     def fsync(self, path, fdatasync, fh):
@@ -381,7 +1243,7 @@ class OdooFS(Operations):
 
 def main(config, odoo):
     print('Connected to odoo, ready to use')
-    FUSE(OdooFS(config, odoo), config.mount_point, nothreads=True, foreground=True)
+    FUSE(OdooFS(config, odoo), config.mount_point, nothreads=not config.threads, foreground=True)
 
 
 class Config:
@@ -396,6 +1258,18 @@ class Config:
         self.uid = None
         self.gid = None
         self.cache = Path.home() / Path('.cache/odoofs')
+        self.page_size = 1000
+        self.poll_interval = 5
+        self.chunk_size = 1024 * 1024
+        self.upload_retries = 5
+        self.batch_size = 0
+        self.threads = False
+        self.sessions = 4
+        self.min_refresh = 60
+        self.max_timeout = 3600
+        self.negative_ttl = 5
+        self.maxage = 0
+        self.maxsize = 0
 
 
 def read_arguments():
@@ -413,6 +1287,24 @@ def read_arguments():
                        default=0)
     parse.add_argument('-M', '--maxsize', type=int, help='Max size in MB the cache can grow to default to no limit',
                        default=0)
+    parse.add_argument('--page-size', type=int, help='Number of directory entries fetched per request',
+                       default=1000)
+    parse.add_argument('--poll', type=int, help='Seconds between checks for changes on odoo', default=5)
+    parse.add_argument('--chunk-size', type=int, help='Bytes transferred per request when reading or writing files',
+                       default=1024 * 1024)
+    parse.add_argument('--upload-retries', type=int, help='Times an interrupted upload is resumed', default=5)
+    parse.add_argument('--batch-size', type=int, default=0,
+                       help='Queue mkdir, create, unlink and rmdir and send them in batches of this size, errors are '
+                            'reported on stderr instead of to the calling program. Disabled by default')
+    parse.add_argument('--threads', action='store_true',
+                       help='Handle file system operations in parallel, each thread uses a session of the pool')
+    parse.add_argument('--sessions', type=int, help='Number of odoo sessions used with --threads', default=4)
+    parse.add_argument('--min-refresh', type=int, default=60,
+                       help='Seconds file attributes are used without asking odoo, older attributes are refreshed in '
+                            'the background')
+    parse.add_argument('--max-timeout', type=int, default=3600,
+                       help='Seconds after which file attributes are refreshed before they are used')
+    parse.add_argument('--negative-ttl', type=int, default=5, help='Seconds a missing file is remembered')
     parse.add_argument('-c', '--config', help='Config file name')
     parse.add_argument('-S', '--segment', help='Config file segment to apply to user, password etc')
     parse.add_argument('--uid', type=int, help='User ID to set file permissions to')
@@ -471,6 +1363,18 @@ def read_arguments():
         rconfig.gid = os.getgid()
     else:
         rconfig.gid = args.gid
+    rconfig.page_size = args.page_size
+    rconfig.poll_interval = args.poll
+    rconfig.chunk_size = args.chunk_size
+    rconfig.upload_retries = args.upload_retries
+    rconfig.batch_size = args.batch_size
+    rconfig.threads = args.threads
+    rconfig.sessions = args.sessions
+    rconfig.min_refresh = args.min_refresh
+    rconfig.max_timeout = args.max_timeout
+    rconfig.negative_ttl = args.negative_ttl
+    rconfig.maxage = args.maxage
+    rconfig.maxsize = args.maxsize
     if args.cache:
         rconfig.cache = args.cache
     else:
@@ -1,10 +1,13 @@
 import unittest
+import time
 from threading import Thread
 from fusepy import FUSE
 from odoofs import *
 import odoorpc
 import os
 import tempfile
+import io
+from urllib.parse import unquote
 from subprocess import Popen
 import random
 from datetime import datetime
@@ -38,6 +41,18 @@ class Config:
         self.password = password
         self.database = database
         self.port = port
+        self.page_size = 1000
+        self.poll_interval = 5
+        self.chunk_size = 4
+        self.upload_retries = 1
+        self.batch_size = 0
+        self.threads = False
+        self.sessions = 1
+        self.min_refresh = 60
+        self.max_timeout = 3600
+        self.negative_ttl = 5
+        self.maxage = 0
+        self.maxsize = 0
 
 
 class MyTestCase(unittest.TestCase):
@@ -178,5 +193,340 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(at1.errno, 2)
 
 
+class FileMetaTestCase(unittest.TestCase):
+    def test_ranges(self):
+        fm = FileMeta('/file1', size=10)
+        fm.ranges = []
+        self.assertEqual(fm.missing(0, 10), [(0, 10)])
+        fm.add_range(2, 4)
+        fm.add_range(6, 8)
+        self.assertEqual(fm.missing(0, 10), [(0, 2), (4, 6), (8, 10)])
+        fm.add_range(3, 7)
+        self.assertEqual(fm.ranges, [[2, 8]])
+        fm.add_range(0, 2)
+        fm.add_range(8, 10)
+        self.assertEqual(fm.ranges, None)
+        self.assertEqual(fm.missing(0, 10), [])
+
+
+class FakeFuse:
+    def __init__(self):
+        self.calls = []
+
+    def getattr_many(self, paths):
+        self.calls.append(paths)
+        return [{'path': path, 'errno': 0} for path in paths]
+
+
+class OpQueueTestCase(unittest.TestCase):
+    def test_submit(self):
+        fuse = FakeFuse()
+        fuse.batch = lambda ops: fuse.calls.append(ops) or [errno.ENOENT if op[0] == 'unlink' else 0 for op in ops]
+        queue = OpQueue(fuse, 3)
+        self.assertEqual(queue.add('mkdir', '/dir1'), [])
+        self.assertEqual(queue.add('create', '/dir1/file1'), [])
+        self.assertEqual(queue.add('unlink', '/dir1/file2'), [(['unlink', '/dir1/file2'], errno.ENOENT)])
+        self.assertEqual(len(fuse.calls), 1)
+        self.assertEqual(queue.submit(), [])
+        self.assertEqual(len(fuse.calls), 1)
+
+
+class FakeSession:
+    def __init__(self, name):
+        self.env = {'fuse.node': self}
+        self.name = name
+        self.active = 0
+
+    def whoami(self):
+        self.active += 1
+        time.sleep(0.01)
+        assert self.active == 1
+        self.active -= 1
+        return self.name
+
+
+class SessionPoolTestCase(unittest.TestCase):
+    def test_pooled_calls(self):
+        pool = SessionPool(FakeSession('session1'), Config('', '', '', ''))
+        pool.sessions.put(FakeSession('session2'))
+        fuse = PooledModel(pool, 'fuse.node')
+        names = []
+        threads = [Thread(target=lambda: names.append(fuse.whoami())) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(names), 8)
+        self.assertEqual(pool.sessions.qsize(), 2)
+
+
+class GetattrBatcherTestCase(unittest.TestCase):
+    def test_coalesce(self):
+        fuse = FakeFuse()
+        batcher = GetattrBatcher(fuse, window=0.05)
+        results = {}
+
+        def stat(path):
+            results[path] = batcher.getattr(path)
+
+        threads = [Thread(target=stat, args=(f'/file{i}',)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results['/file3']['path'], '/file3')
+        self.assertLess(len(fuse.calls), 10)
+
+
+class AttrCacheTestCase(unittest.TestCase):
+    def test_invalidate_keeps_content(self):
+        rattrs = {'errno': 0, 'st_mode': stat.S_IFREG | 0o644, 'st_size': 3, 'st_ctime': 1, 'st_mtime': 1,
+                  'st_atime': 1, 'checksum': 'abc'}
+        fuse = FakeFuse()
+        fuse.getattr = lambda path: dict(rattrs, st_mtime=2)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            attr = AttrCache(cache_dir, fuse)
+            fm = attr.refresh('/file1', rattrs)
+            fm.lchecksum = 'abc'
+            attr['/file1'] = fm
+            attr.invalidate('/')
+            self.assertEqual(attr.meta['/file1'].astime, 0)
+            fm = attr['/file1']
+            self.assertEqual(fm.rmtime, 2)
+            self.assertEqual(fm.checksum, fm.lchecksum)
+
+    def test_ttl(self):
+        fuse = FakeFuse()
+        fuse.getattr = lambda path: fuse.calls.append(path)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            attr = AttrCache(cache_dir, fuse, min_refresh=60, max_timeout=3600, negative_ttl=5)
+            self.assertEqual(attr['/missing'].errno, errno.ENOENT)
+            self.assertEqual(attr['/missing'].errno, errno.ENOENT)
+            self.assertEqual(fuse.calls, ['/missing'])
+            attr['/file1'] = FileMeta('/file1', errno=0, astime=_now() - 10)
+            self.assertEqual(attr.state(attr.meta['/missing']), 'fresh')
+            self.assertEqual(attr.state(attr.meta['/file1']), 'fresh')
+            attr['/missing'] = FileMeta('/missing', astime=_now() - 10)
+            self.assertEqual(attr.state(attr.meta['/missing']), 'expired')
+            attr['/file1'] = FileMeta('/file1', errno=0, astime=_now() - 600)
+            self.assertEqual(attr.state(attr.meta['/file1']), 'stale')
+            attr['/file1'] = FileMeta('/file1', errno=0, astime=_now() - 7200)
+            self.assertEqual(attr.state(attr.meta['/file1']), 'expired')
+
+    def test_move(self):
+        fuse = FakeFuse()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            attr = AttrCache(cache_dir, fuse)
+            attr['/dir1'] = FileMeta('/dir1', errno=0, astime=1)
+            attr['/dir1/file1'] = FileMeta('/dir1/file1', errno=0, astime=1)
+            attr.full_path('/dir1').mkdir()
+            attr.full_path('/dir1/file1').write_bytes(b'123')
+            attr.move('/dir1', '/dir2')
+            self.assertNotIn('/dir1/file1', attr.meta)
+            self.assertEqual(attr.meta['/dir2/file1'].filename, Path('/dir2/file1'))
+            self.assertEqual(attr.meta['/dir2/file1'].astime, 0)
+            self.assertEqual(attr.full_path('/dir2/file1').read_bytes(), b'123')
+
+
+class MetaStoreTestCase(unittest.TestCase):
+    def test_persistent(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            store = MetaStore(Path(cache_dir) / 'meta.db')
+            fm = FileMeta('/dir1/file1', errno=0, size=10, astime=1)
+            fm.add_range(0, 4)
+            store['/dir1/file1'] = fm
+            store.close()
+            store = MetaStore(Path(cache_dir) / 'meta.db')
+            fm = store['/dir1/file1']
+            self.assertEqual(fm.size, 10)
+            self.assertEqual(fm.missing(0, 10), [(4, 10)])
+            self.assertEqual(list(store), ['/dir1/file1'])
+
+    def test_under(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            store = MetaStore(Path(cache_dir) / 'meta.db')
+            store.put_many(FileMeta(path, errno=0, astime=1) for path in ('/dir1', '/dir1/file1', '/dir10'))
+            self.assertEqual(sorted(str(fm.filename) for fm in store.under('/dir1')), ['/dir1', '/dir1/file1'])
+            store.update_under('/dir1', astime=0)
+            self.assertEqual(store['/dir1/file1'].astime, 0)
+            self.assertEqual(store['/dir10'].astime, 1)
+
+
+class BlobStoreTestCase(unittest.TestCase):
+    def test_share(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            attr = AttrCache(cache_dir, FakeFuse())
+            attr.full_path('/file1').write_bytes(b'123')
+            checksum = attr.checksum('/file1')
+            attr['/file1'] = FileMeta('/file1', errno=0, stime=1)
+            fm = attr.meta['/file1']
+            fm.lchecksum = checksum
+            attr['/file1'] = fm
+            attr.share('/file1')
+            self.assertIn(checksum, attr.blobs)
+            fm = FileMeta('/file2', errno=0, size=3)
+            fm.checksum = checksum
+            self.assertTrue(attr.link('/file2', fm))
+            self.assertTrue(attr.full_path('/file1').samefile(attr.full_path('/file2')))
+            self.assertEqual(attr.meta['/file2'].lchecksum, checksum)
+            attr.detach('/file2')
+            attr.full_path('/file2').write_bytes(b'456')
+            self.assertEqual(attr.full_path('/file1').read_bytes(), b'123')
+            self.assertEqual(attr.blobs.path(checksum).read_bytes(), b'123')
+            attr.evict('/file1')
+            attr.blobs.prune()
+            self.assertNotIn(checksum, attr.blobs)
+
+    def test_release(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            attr = AttrCache(cache_dir, FakeFuse())
+            attr['/file1'] = FileMeta('/file1', errno=0)
+            for content in (b'1', b'2', b'3'):
+                attr.cache_open('/file1', content)
+                fm = attr.meta['/file1']
+                fm.lchecksum = attr.checksum('/file1')
+                attr['/file1'] = fm
+                attr.share('/file1')
+            self.assertEqual(len(list(attr.blobs.root.glob('??/*'))), 1)
+            attr.detach('/file1')
+            self.assertEqual(len(list(attr.blobs.root.glob('??/*'))), 0)
+
+
+class FakeResponse(io.BytesIO):
+    """Whole file response of the content route"""
+    status = 200
+
+
+class FakeServer:
+    """fuse.node and fuse.change of an odoo server, paths maps the existing paths to their st_mode"""
+
+    def __init__(self):
+        self.env = {'fuse.node': self, 'fuse.change': self}
+        self.paths = {'/': stat.S_IFDIR | 0o755}
+        self.errors = {}
+        # Content and st_mtime of files
+        self.contents = {}
+        self.mtimes = {}
+        self.downloads = 0
+
+    def changes_since(self, seq, seen=None):
+        return {'seq': 0, 'seen': [], 'reset': False, 'paths': []}
+
+    def http(self, url, data=None, headers=None):
+        self.downloads += 1
+        return FakeResponse(self.contents[unquote(url[len('fuse/content'):])])
+
+    def getattr_many(self, paths):
+        return [{'errno': 0, 'st_mode': self.paths[path], 'st_size': len(self.contents.get(path, b'')),
+                 'st_ctime': 1, 'st_mtime': self.mtimes.get(path, 1),
+                 'st_atime': 1} if path in self.paths else {'errno': errno.ENOENT, 'st_mode': 0, 'st_size': 0,
+                                                            'st_ctime': 0, 'st_mtime': 0, 'st_atime': 0}
+                for path in paths]
+
+    def batch(self, ops):
+        results = []
+        for op in ops:
+            ierr = self.errors.get(op[0], 0)
+            if not ierr and op[0] == 'mkdir':
+                self.paths[op[1]] = stat.S_IFDIR | 0o755
+            elif not ierr and op[0] in ('rmdir', 'unlink'):
+                del self.paths[op[1]]
+            elif not ierr and op[0] == 'rename':
+                self.paths[op[2]] = self.paths.pop(op[1])
+            results.append(ierr)
+        return results
+
+    def __getattr__(self, method):
+        return lambda *args: self.batch([[method.replace('fs_', '')] + list(args)])[0]
+
+
+class OdooFSTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.config = Config()
+        self.config.cache = self.cache_dir.name
+        self.config.uid = self.config.gid = 0
+        self.server = FakeServer()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_mkdir_after_lookup(self):
+        odoofs = OdooFS(self.config, self.server)
+        self.assertRaises(FuseOSError, odoofs.getattr, '/dir1')
+        odoofs.mkdir('/dir1', 0o755)
+        self.assertTrue(stat.S_ISDIR(odoofs.getattr('/dir1')['st_mode']))
+        odoofs.rmdir('/dir1')
+        self.assertRaises(FuseOSError, odoofs.getattr, '/dir1')
+        self.server.paths['/file1'] = stat.S_IFREG | 0o644
+        odoofs.getattr('/file1')
+        odoofs.unlink('/file1')
+        self.assertNotIn('/file1', self.server.paths)
+        self.assertRaises(FuseOSError, odoofs.getattr, '/file1')
+
+    def test_reopen_after_remote_change(self):
+        self.server.paths['/file1'] = stat.S_IFREG | 0o644
+        self.server.contents['/file1'] = b'abc'
+        odoofs = OdooFS(self.config, self.server)
+
+        def cat():
+            fh = odoofs.open('/file1', os.O_RDONLY)
+            data = odoofs.read('/file1', 100, 0, fh)
+            odoofs.release('/file1', fh)
+            return data
+
+        self.assertEqual(cat(), b'abc')
+        self.server.contents['/file1'] = b'abcd'
+        self.server.mtimes['/file1'] = 2
+        odoofs.attr.invalidate('/file1')
+        self.assertEqual(cat(), b'abcd')
+        self.assertEqual(cat(), b'abcd')
+        self.assertEqual(self.server.downloads, 2)
+
+    def test_rename_refused(self):
+        self.config.batch_size = 1
+        self.server.paths['/file1'] = stat.S_IFREG | 0o644
+        self.server.errors['rename'] = errno.EACCES
+        odoofs = OdooFS(self.config, self.server)
+        odoofs.getattr('/file1')
+        with self.assertRaises(FuseOSError) as error:
+            odoofs.rename('/file1', '/file2')
+        self.assertEqual(error.exception.errno, errno.EACCES)
+        self.assertIn('/file1', odoofs.attr.meta)
+
+
+class CacheEvictorTestCase(unittest.TestCase):
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            attr = AttrCache(cache_dir, FakeFuse())
+            for i, name in enumerate(['/old', '/dirty', '/open', '/new']):
+                attr.meta[name] = FileMeta(name, errno=0, atime=_now() - 1000 + i, stime=1, mtime=1,
+                                           rmtime=0 if name == '/dirty' else 1)
+                attr.full_path(name).write_bytes(b'x' * 8192)
+            attr.opened('/open')
+            evictor = CacheEvictor(attr, maxsize=8192)
+            self.assertEqual(evictor.evict(), ['/old', '/new'])
+            self.assertFalse(attr.full_path('/old').exists())
+            self.assertEqual(attr.meta['/old'].stime, 0)
+            self.assertTrue(attr.full_path('/dirty').exists())
+            self.assertTrue(attr.full_path('/open').exists())
+            attr.released('/open')
+            self.assertEqual(evictor.evict(), ['/open'])
+            self.assertEqual(CacheEvictor(attr, maxage=1).evict(), [])
+
+    def test_shared_inode(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            attr = AttrCache(cache_dir, FakeFuse())
+            for i, name in enumerate(['/file1', '/file2', '/file3']):
+                attr.meta[name] = FileMeta(name, errno=0, atime=_now() - 1000 + i, stime=1)
+            attr.full_path('/file1').write_bytes(b'x' * 8192)
+            os.link(attr.full_path('/file1'), attr.full_path('/file2'))
+            attr.full_path('/file3').write_bytes(b'x' * 8192)
+            # Evicting /file1 frees nothing while /file2 links to the same content
+            self.assertEqual(CacheEvictor(attr, maxsize=8192).evict(), ['/file1', '/file2'])
+            self.assertTrue(attr.full_path('/file3').exists())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,21 +1,82 @@
 # -*- coding: utf-8 -*-
-# from odoo import http
-
-
-# class Fuse(http.Controller):
-#     @http.route('/fuse/fuse/', auth='public')
-#     def index(self, **kw):
-#         return "Hello, world"
-
-#     @http.route('/fuse/fuse/objects/', auth='public')
-#     def list(self, **kw):
-#         return http.request.render('fuse.listing', {
-#             'root': '/fuse/fuse',
-#             'objects': http.request.env['fuse.fuse'].search([]),
-#         })
-
-#     @http.route('/fuse/fuse/objects/<model("fuse.fuse"):obj>/', auth='public')
-#     def object(self, obj, **kw):
-#         return http.request.render('fuse.object', {
-#             'object': obj
-#         })
+from odoo import http
+from odoo.http import request, Response
+import errno
+import json
+
+# Bytes read from the filestore per response chunk
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _stream_file(f, start, stop):
+    """Yield the bytes start to stop of a file path or file object, the file is closed at the end"""
+    with (open(f, 'rb') if isinstance(f, str) else f) as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+class Fuse(http.Controller):
+    """Raw binary access to file content, metadata stays on the fuse.node RPC methods"""
+
+    @http.route('/fuse/content/<path:path>', type='http', auth='user', methods=['GET', 'HEAD'])
+    def content(self, path, **kw):
+        """Stream the content (bin_field, rendered report or export) of a path, supports Range, ETag and If-None-Match"""
+        inode, imodel = request.env['fuse.node'].findpath('/' + path)
+        if not inode or not (imodel or inode.aggregate) or not inode._has_content():
+            return request.not_found()
+        source = inode._content_source(imodel)
+        size = source['size']
+        etag = source['checksum']
+        headers = [('Content-Type', 'application/octet-stream'),
+                   ('Accept-Ranges', 'bytes' if source.get('ranges', True) else 'none')]
+        if etag:
+            headers.append(('ETag', f'"{etag}"'))
+
+        if etag and request.httprequest.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+
+        status = 200
+        start, stop = 0, size
+        # Generated content may change between requests so it is always sent whole
+        if request.httprequest.range and source.get('ranges', True):
+            byte_range = request.httprequest.range.range_for_length(size)
+            if not byte_range:
+                return Response(status=416, headers=headers + [('Content-Range', f'bytes */{size}')])
+            start, stop = byte_range
+            status = 206
+            headers.append(('Content-Range', f'bytes {start}-{stop - 1}/{size}'))
+        headers.append(('Content-Length', str(stop - start)))
+
+        if source['path'] or source.get('file'):
+            body = _stream_file(source['path'] or source['file'], start, stop)
+        else:
+            body = [source['data'][start:stop]]
+        return Response(body, status=status, headers=headers, direct_passthrough=True)
+
+    @http.route('/fuse/content/<path:path>', type='http', auth='user', methods=['PUT', 'POST'], csrf=False)
+    def content_write(self, path, **kw):
+        """Replace the bin_field of a path with the request body, CSV files are applied to the records"""
+        inode, imodel = request.env['fuse.node'].findpath('/' + path)
+        if not inode or not (imodel or inode.aggregate) or not inode._is_writable():
+            return request.not_found()
+        if inode._write_content(imodel, request.httprequest.get_data()):
+            return Response(status=400)
+        return Response(status=204)
+
+    @http.route('/fuse/upload/<string:token>', type='http', auth='user', methods=['PUT', 'POST'], csrf=False)
+    def upload_chunk(self, token, offset=0, **kw):
+        """Append the raw request body to an upload session, see fuse.node.upload_chunk"""
+        session = request.env['fuse.upload']._find(token)
+        if not session:
+            result = {'errno': errno.ENOENT, 'offset': 0}
+        elif not session.append(int(offset), request.httprequest.get_data()):
+            result = {'errno': errno.EINVAL, 'offset': int(session.offset)}
+        else:
+            result = {'errno': 0, 'offset': int(session.offset)}
+        return Response(json.dumps(result), headers=[('Content-Type', 'application/json')])
@@ -1,3 +1,7 @@
 # -*- coding: utf-8 -*-
 
-from . import fuse_node
\ No newline at end of file
+from . import fuse_node
+from . import fuse_path_index
+from . import fuse_change
+from . import fuse_upload
+from . import fuse_report_cache
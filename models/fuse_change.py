@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from datetime import timedelta
+
+# Maximum number of journal rows returned by one changes_since call
+CHANGES_PAGE_SIZE = 1000
+# Seconds a journal row may become visible after rows with higher ids, the time the longest transaction can take
+# from its first change to its commit
+CHANGES_SETTLE_SECONDS = 300
+
+
+class FUSEChange(models.Model):
+    _name = 'fuse.change'
+    _description = 'Journal of record changes affecting fuse paths, the id is the sequence clients poll with'
+    _order = 'id'
+
+    res_model = fields.Char('Model', required=True)
+    operation = fields.Selection([('create', 'Create'), ('write', 'Write'), ('unlink', 'Unlink')], required=True)
+    paths = fields.Text('Paths', help='Affected paths one per line, each path includes everything below it')
+
+    @api.model
+    def _log_change(self, res_model, operation, paths):
+        if paths:
+            self.sudo().create({'res_model': res_model, 'operation': operation, 'paths': '\n'.join(sorted(paths))})
+
+    @api.model
+    def changes_since(self, seq=0, seen=None):
+        """Return the paths changed after seq
+
+            A transaction commits its rows after rows with higher ids may already be visible, seq only moves past
+            rows older than fuse.change_settle_seconds. Younger rows are returned in seen and are not returned again
+            when seen is passed back.
+            Call with seq 0 to get the current sequence.
+            output: {'seq': sequence to poll with next,
+                     'seen': ids after seq already returned, passed with the next call,
+                     'paths': changed paths (including everything below them),
+                     'reset': True if the journal no longer covers seq and all cached data must be dropped}
+        """
+        journal = self.sudo()
+        if not seq:
+            last = journal.search([], order='id desc', limit=1)
+            return {'seq': last.id or self._gc_floor(), 'seen': [], 'paths': [], 'reset': False}
+        if seq < self._gc_floor():
+            return {'seq': self._gc_floor(), 'seen': [], 'paths': [], 'reset': True}
+        seen = [res_id for res_id in seen or [] if res_id > seq]
+        rows = journal.search_read([('id', '>', seq), ('id', 'not in', seen)], ['paths'], limit=CHANGES_PAGE_SIZE)
+        paths = set()
+        for row in rows:
+            paths.update((row['paths'] or '').splitlines())
+        known = seen + [row['id'] for row in rows]
+        settle = int(self.env['ir.config_parameter'].sudo().get_param('fuse.change_settle_seconds',
+                                                                      CHANGES_SETTLE_SECONDS))
+        unsettled = journal.search([('id', '>', seq),
+                                    ('create_date', '>=', fields.Datetime.now() - timedelta(seconds=settle))],
+                                   limit=1)
+        seq = max([seq] + [res_id for res_id in known if not unsettled or res_id < unsettled.id])
+        return {'seq': seq, 'seen': sorted(res_id for res_id in known if res_id > seq), 'paths': sorted(paths),
+                'reset': False}
+
+    @api.model
+    def _gc_floor(self):
+        """Highest sequence removed from the journal"""
+        return int(self.env['ir.config_parameter'].sudo().get_param('fuse.change_floor', 0))
+
+    @api.model
+    def _gc_changes(self):
+        """Remove journal rows older than fuse.change_retention_days (default 7)"""
+        config = self.env['ir.config_parameter'].sudo()
+        days = int(config.get_param('fuse.change_retention_days', 7))
+        old = self.sudo().search([('create_date', '<', fields.Datetime.now() - timedelta(days=days))])
+        if old:
+            config.set_param('fuse.change_floor', max(old.ids))
+            old.unlink()
@@ -1,11 +1,84 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
+from odoo.exceptions import AccessError, UserError, ValidationError
+from odoo.osv import expression
+from odoo.tools.lru import LRU
+from odoo.tools.safe_eval import test_expr, _SAFE_OPCODES, _BUILTINS
+from collections import namedtuple
 import errno
-from pathlib import Path
+import os
+from pathlib import Path, PurePosixPath
 from stat import *
 from datetime import datetime
+from string import Formatter
+from base64 import b64encode, b64decode
+import csv
+import hashlib
+import io
+import psycopg2
+import json
 import re
+import tempfile
+import time
+
+# Field types whose rendered value can be turned back into a search value
+INVERTIBLE_FIELD_TYPES = ('char', 'text', 'selection', 'integer')
+# Field types that cannot be rendered from values returned by search_read
+RECORD_FIELD_TYPES = ('many2one', 'one2many', 'many2many', 'reference', 'binary')
+# Resolved paths kept per registry, dropped when the path version changes (see FUSE._path_version). Entries also
+# expire, a worker whose transaction started before another worker committed a change can cache the old path
+PATH_CACHE_SIZE = 8192
+PATH_CACHE_TIMEOUT = 60
+# Sizes and checksums of generated aggregate files kept per registry
+EXPORT_CACHE_SIZE = 1024
+# Writes on more records than this journal the node directories instead of every record path
+JOURNAL_RECORD_LIMIT = 100
+# Default number of directory entries returned by readdir_page
+READDIR_PAGE_SIZE = 1000
+# Node fields that change the rendered names stored in fuse.path_index
+PATH_INDEX_FIELDS = ('model_id', 'parent_id', 'parent_field_id', 'name_pattern', 'filter_domain', 'use_path_index')
+# Records read per batch when generating export files
+EXPORT_BATCH_SIZE = 1000
+# Generated export files are kept in memory up to this size, larger files are spooled to disk
+EXPORT_SPOOL_SIZE = 1024 * 1024
+
+
+def _make_create():
+    """Instantiate a create method that keeps fuse data in sync with the created records"""
+
+    @api.model_create_multi
+    def create(self, vals_list, **kw):
+        records = create.origin(self, vals_list, **kw)
+        self.env['fuse.node']._on_records_changed(records, 'create')
+        return records
+
+    create.fuse_patch = True
+    return create
+
+
+def _make_write():
+    """Instantiate a write method that keeps fuse data in sync with the written records"""
+
+    def write(self, vals, **kw):
+        old_paths = self.env['fuse.node']._journal_paths(self)
+        res = write.origin(self, vals, **kw)
+        self.env['fuse.node']._on_records_changed(self, 'write', old_paths)
+        return res
+
+    write.fuse_patch = True
+    return write
+
+
+def _make_unlink():
+    """Instantiate an unlink method that keeps fuse data in sync with the removed records"""
+
+    def unlink(self, **kw):
+        self.env['fuse.node']._on_records_changed(self, 'unlink')
+        return unlink.origin(self, **kw)
+
+    unlink.fuse_patch = True
+    return unlink
 
 
 class FUSEDefaultValues(models.Model):
@@ -19,12 +92,84 @@ class FUSEDefaultValues(models.Model):
     field_value = fields.Char('Value', help='Can be integer or string, string in quotes, can also refer '
                                             'to another field using fieldname')
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(FUSEDefaultValues, self).create(vals_list)
+
+    def write(self, vals):
+        self.clear_caches()
+        return super(FUSEDefaultValues, self).write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super(FUSEDefaultValues, self).unlink()
+
     @api.depends('field_id', 'field_value')
     def _compute_eval(self):
         for default_value in self:
             default_value.display_name = f"{default_value.field_id.model} = {default_value.field_value}"
 
 
+# Node expressions compiled once per node version, see FUSE._compiled()
+CompiledNode = namedtuple('CompiledNode', ['filter_domain', 'file_size', 'name_pattern', 'name_re', 'field_values'])
+
+
+def compile_expr(expr):
+    """Compile expr with the same checks as safe_eval, evaluate the result with eval_expr"""
+    return test_expr(expr, _SAFE_OPCODES, mode='eval') if expr else None
+
+
+def eval_expr(code, context=None):
+    """Evaluate an expression compiled with compile_expr using the safe_eval builtins"""
+    return eval(code, dict(context or {}, __builtins__=_BUILTINS))
+
+
+def _json_default(value):
+    """Serialize values json does not handle, binary fields are read as base64 bytes"""
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+def _csv_value(field, value):
+    """Render a value returned by read as a CSV cell, relations are written as ids"""
+    if field.type == 'many2one':
+        return str(value[0]) if value else ''
+    if field.type in ('one2many', 'many2many'):
+        return ','.join(str(res_id) for res_id in value)
+    if field.type == 'boolean':
+        return '1' if value else '0'
+    if value is False or value is None:
+        return ''
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+def _csv_parse(field, cell):
+    """Convert a CSV cell into a value for write or create, raises ValueError on invalid cells"""
+    cell = cell.strip() if field.type not in ('char', 'text', 'html') else cell
+    if field.type == 'boolean':
+        return cell.lower() in ('1', 'true', 'yes')
+    if field.type == 'many2one':
+        return int(cell) if cell else False
+    if field.type in ('one2many', 'many2many'):
+        return [(6, 0, [int(res_id) for res_id in cell.split(',') if res_id.strip()])]
+    if field.type == 'integer':
+        return int(cell) if cell else 0
+    if field.type in ('float', 'monetary'):
+        return float(cell) if cell else 0.0
+    return cell or False
+
+
+class RecordValues:
+    """Attribute access to values read with search_read, stands in for a record when rendering name_pattern"""
+
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+
 # What is the right symantics, when creating a file node.
 # 1. If parent node exist, then use parent_field_id to attach current node to parents model.
 # 2. If the parent does not have a model attached, then the parent node is used as the model is used for lookup and assignments
@@ -33,6 +178,7 @@ class FUSE(models.Model):
     _name = 'fuse.node'
     _description = 'Fuse Node describing directory or file properties'
     _rec_name = 'display_name'
+    _parent_store = True
 
     display_name = fields.Char(compute='_compute_display_name', store=True)
     name = fields.Char('Name', help='Static name or {item} to access object')
@@ -41,7 +187,8 @@ class FUSE(models.Model):
     # variable will be assigned to self.
     description = fields.Char('Description')
     type = fields.Selection(selection=[('file', 'File'), ('dir', 'Directory')], default='dir')
-    parent_id = fields.Many2one('fuse.node')
+    parent_id = fields.Many2one('fuse.node', index=True)
+    parent_path = fields.Char(index=True)
     model_id = fields.Many2one('ir.model',
                                help='For static directories (where name does not change) no model must be assigned')  # Model this node applies to (can be parent_field_id)
     res_model = fields.Char(related='model_id.model')
@@ -58,12 +205,390 @@ class FUSE(models.Model):
     path_name = fields.Char('Path Name', help='Path name', default='The Static file/directory Name')
     filter_domain = fields.Char('Filter Domain', default='[]')  # Domain to filter
     full_path = fields.Char(compute="_compute_full_path")
-    file_content = fields.Selection([('bin', 'Binary'), ('json', 'JSON Format'), ('report', 'Report')])
+    file_content = fields.Selection([('bin', 'Binary'), ('json', 'JSON Format'), ('csv', 'CSV Format'),
+                                     ('report', 'Report')])
     file_size = fields.Char('File Size Script',
                             help='This is a script to determine file size. In most cases just a field name')
+    size_strategy = fields.Selection([('auto', 'Automatic'),
+                                      ('attachment', 'Attachment Size'),
+                                      ('field', 'Size Field'),
+                                      ('script', 'File Size Script')], 'File Size', default='auto', required=True,
+                                     help='Automatic uses the file size script if set, else the size of the attachment '
+                                          'holding the binary field, else a file_size field of the model')
+    size_field_id = fields.Many2one('ir.model.fields', 'Size Field',
+                                    help='Stored field holding the size of the content in bytes')
     bin_field = fields.Many2one('ir.model.fields')
     report_id = fields.Many2one('ir.actions.report', 'Report')
-    json_fields = fields.Many2many('ir.model.fields')
+    json_fields = fields.Many2many('ir.model.fields', string='Exported Fields',
+                                   help='Fields written to JSON and CSV files, id is always included')
+    aggregate = fields.Boolean('All Records in One File',
+                               help='The node is a single file named after the node containing all records it lists')
+    use_path_index = fields.Boolean('Index Filenames',
+                                    help='Store the rendered filenames so lookups and listings use one indexed query. '
+                                         'Names are refreshed when the records are created, written or removed, '
+                                         'patterns should only use fields of the record itself')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        nodes = super(FUSE, self).create(vals_list)
+        self._clear_path_caches()
+        nodes.filtered('use_path_index')._path_index_rebuild()
+        if any(vals.get('model_id') for vals in vals_list):
+            self._update_registry()
+        return nodes
+
+    def write(self, vals):
+        res = super(FUSE, self).write(vals)
+        self._clear_path_caches()
+        if any(field in vals for field in PATH_INDEX_FIELDS):
+            self._path_index_rebuild()
+        if 'model_id' in vals:
+            self._update_registry()
+        return res
+
+    def unlink(self):
+        self.env['fuse.report.cache'].sudo().search([('node_id', 'in', self.ids)]).unlink()
+        res = super(FUSE, self).unlink()
+        self._clear_path_caches()
+        self._update_registry()
+        return res
+
+    def _register_hook(self):
+        """Patch create/write/unlink of the models used by nodes so fuse data follows record changes"""
+        super(FUSE, self)._register_hook()
+        for model_name in set(self.sudo().search([('model_id', '!=', False)]).mapped('res_model')):
+            Model = self.env.registry.get(model_name)
+            if Model is None or getattr(Model.write, 'fuse_patch', False):
+                continue
+            Model._patch_method('create', _make_create())
+            Model._patch_method('write', _make_write())
+            Model._patch_method('unlink', _make_unlink())
+
+    def _unregister_hook(self):
+        """Remove the patches installed by _register_hook()"""
+        for Model in self.env.registry.values():
+            for name in ('create', 'write', 'unlink'):
+                if getattr(getattr(Model, name), 'fuse_patch', False):
+                    Model._revert_method(name)
+
+    def _update_registry(self):
+        """Update the model patches after nodes changed and notify other workers"""
+        if self.env.registry.ready and not self.env.context.get('import_file'):
+            self._unregister_hook()
+            self._register_hook()
+            self.env.registry.registry_invalidated = True
+
+    @api.model
+    def _on_records_changed(self, records, operation, old_paths=()):
+        """Called by the patched create/write/unlink of models used by nodes, unlink is called before removal
+
+            inputs: records - The records that changed
+                    operation - create, write or unlink
+                    old_paths - Paths of the records before a write
+        """
+        if operation != 'create':
+            self._path_cache().clear()
+            self._signal_path_change()
+        self.env['fuse.change']._log_change(records._name, operation, set(old_paths) | self._journal_paths(records))
+        if operation != 'create' and any(node.file_content == 'report'
+                                         for node in self.browse(self._model_node_ids(records._name)).sudo()):
+            self.env['fuse.report.cache']._invalidate(records._name, records.ids)
+        nodes = self.browse(self._model_node_ids(records._name)).sudo().filtered('use_path_index')
+        if not nodes:
+            return
+        if operation == 'unlink':
+            self.env['fuse.path_index'].sudo().search([('node_id', 'in', nodes.ids),
+                                                      ('res_id', 'in', records.ids)]).unlink()
+        else:
+            nodes._path_index_refresh(records)
+
+    @api.model
+    @tools.ormcache()
+    def _node_tree(self):
+        """Map each node id (False for top level nodes) to the ids of its children, ordered by id"""
+        tree = {}
+        for node in self.sudo().search_read([], ['parent_id'], order='id'):
+            tree.setdefault(node['parent_id'] and node['parent_id'][0], []).append(node['id'])
+        return {parent_id: tuple(child_ids) for parent_id, child_ids in tree.items()}
+
+    @api.model
+    @tools.ormcache('node_id', 'write_date')
+    def _compiled_expressions(self, node_id, write_date):
+        node = self.sudo().browse(node_id)
+        try:
+            name_pattern = tuple(Formatter().parse(node.name_pattern or ''))
+        except ValueError:
+            name_pattern = None
+        try:
+            name_re = re.compile(node.name_re_pattern) if node.name_re_pattern else None
+        except re.error:
+            name_re = None
+        return CompiledNode(filter_domain=compile_expr(node.filter_domain or '[]'),
+                            file_size=compile_expr(node.file_size),
+                            name_pattern=name_pattern,
+                            name_re=name_re,
+                            field_values=tuple((value.field_id.name, compile_expr(value.field_value))
+                                               for value in node.field_value_ids))
+
+    def _compiled(self):
+        """Return the compiled filter_domain, file_size, name_pattern, name_re_pattern and default values"""
+        self.ensure_one()
+        return self._compiled_expressions(self.id, self.write_date)
+
+    def _filter_domain(self):
+        self.ensure_one()
+        return eval_expr(self._compiled().filter_domain)
+
+    def _default_values(self):
+        """Evaluate the default values (field_value_ids) of the node"""
+        self.ensure_one()
+        return {field_name: eval_expr(code) for field_name, code in self._compiled().field_values}
+
+    def _match_values(self, name, parent_model_id=None):
+        """Convert a filename into field values using name_re_pattern, the parent field and the default values
+
+            output: dict with field values or None if name does not match
+        """
+        self.ensure_one()
+        name_re = self._compiled().name_re
+        if not name_re or not self.model_id or self.aggregate:
+            return None
+        match1 = name_re.fullmatch(str(name))
+        if not match1:
+            return None
+        field_values = match1.groupdict()
+        if parent_model_id and self.parent_field_id:
+            field_values.update({self.parent_field_id.name: parent_model_id.id})
+        field_values.update(self._default_values())
+        return field_values
+
+    def _move_values(self, model_id, name, parent_model_id=None):
+        """Field values that list model_id as name below parent_model_id in this node
+
+            The name is parsed with name_re_pattern, a name that does not parse is accepted when it is the name the
+            record already renders to (a move without rename). The parent field and default values are always set.
+            output: dict with field values or None if the node cannot list model_id
+        """
+        self.ensure_one()
+        if not self.model_id or self.aggregate or self.model_id.model != model_id._name:
+            return None
+        field_values = self._match_values(name, parent_model_id)
+        if field_values is None:
+            try:
+                rendered = self._render_name(model_id, parent_model_id)
+            except (AttributeError, KeyError, ValueError):
+                return None
+            if rendered != name:
+                return None
+            field_values = self._default_values()
+            if parent_model_id and self.parent_field_id:
+                field_values[self.parent_field_id.name] = parent_model_id.id
+        return field_values
+
+    def _children(self, types=None):
+        """Return the child nodes from the cached node tree, optionally only of types"""
+        self.ensure_one()
+        children = self.browse(self._node_tree().get(self.id, ()))
+        if types:
+            children = children.filtered(lambda node: node.type in types)
+        return children
+
+    @api.model
+    def _path_cache(self):
+        """The resolved path cache of this registry, maps (uid, lang, path) to (tree, time, node id, model, res id,
+        path version)"""
+        cache = getattr(self.pool, '_fuse_path_cache', None)
+        if cache is None:
+            cache = self.pool._fuse_path_cache = LRU(PATH_CACHE_SIZE)
+        return cache
+
+    def init(self):
+        self._cr.execute("CREATE SEQUENCE IF NOT EXISTS fuse_path_seq")
+
+    @api.model
+    def _path_version(self):
+        """Version of the records resolved by findpath, shared by the workers through a sequence"""
+        self.env.cr.execute("SELECT last_value FROM fuse_path_seq")
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _signal_path_change(self):
+        """Bump the path version when the current transaction commits, all workers then drop their resolved paths
+
+            The version is bumped after the commit so a path resolved with the new version sees the changes.
+        """
+        cr = self.env.cr
+        if getattr(cr, '_fuse_path_signal', False):
+            return
+        cr._fuse_path_signal = True
+        registry = self.pool
+
+        def bump():
+            cr._fuse_path_signal = False
+            with registry.cursor() as signal_cr:
+                signal_cr.execute("SELECT nextval('fuse_path_seq')")
+
+        def reset():
+            cr._fuse_path_signal = False
+
+        cr.after('commit', bump)
+        cr.after('rollback', reset)
+
+    @api.model
+    def _export_cache(self):
+        """Size and checksum of aggregate files per registry, keys include the version of the exported records"""
+        cache = getattr(self.pool, '_fuse_export_cache', None)
+        if cache is None:
+            cache = self.pool._fuse_export_cache = LRU(EXPORT_CACHE_SIZE)
+        return cache
+
+    @api.model
+    def _clear_path_caches(self):
+        self.clear_caches()
+        self._path_cache().clear()
+
+    @api.model
+    @tools.ormcache('self.env.uid', 'node_id')
+    def _node_mode(self, node_id):
+        """Mode bits of a node for the current user from the access rights on its models
+
+            Cached per user and node, the cache is cleared when access rights, groups or nodes change. Record rules
+            are not part of the mode, listings only return readable records and writes refused by a rule return
+            EACCES.
+        """
+        node = self.sudo().browse(node_id)
+        # Rights of the user even when called from a sudo environment, the cache is keyed by uid
+        env = self.env(su=False)
+
+        def allowed(model_name, operation):
+            model = env.get(model_name)
+            return model is not None and model.check_access_rights(operation, raise_exception=False)
+
+        readable = not node.model_id or allowed(node.res_model, 'read')
+        if node.type == 'dir':
+            # Entries can be added, removed or renamed if a child node model allows it
+            writable = any(allowed(child.res_model, operation)
+                           for child in node._children().filtered('model_id')
+                           for operation in ('create', 'write', 'unlink'))
+            mode = S_IFDIR | (S_IRUSR | S_IXUSR | S_IRGRP | S_IXGRP if readable else 0)
+        else:
+            writable = node._is_writable() and allowed(node.res_model, 'write')
+            mode = S_IFREG | (S_IRUSR | S_IRGRP if readable else 0)
+        return mode | (S_IWUSR | S_IWGRP if writable else 0)
+
+    def _mode(self):
+        self.ensure_one()
+        return self._node_mode(self.id)
+
+    @api.model
+    @tools.ormcache('model_name')
+    def _model_node_ids(self, model_name):
+        """Return the ids of the nodes listing records of model_name"""
+        return tuple(self.sudo().search([('res_model', '=', model_name)]).ids)
+
+    @api.model
+    def _journal_paths(self, records):
+        """Return the paths under which records are listed, used for the fuse.change journal"""
+        paths = set()
+        for node in self.browse(self._model_node_ids(records._name)).sudo():
+            if len(records) > JOURNAL_RECORD_LIMIT:
+                paths.update(node._listing_paths())
+                continue
+            try:
+                for model_id in records.sudo().exists():
+                    paths.update(node._record_paths(model_id))
+            except Exception:
+                # A pattern that cannot be rendered must not block writes on the model
+                paths.update(node._listing_paths())
+        return paths
+
+    def _static_ancestors(self):
+        """Return the names of the static nodes between this node and its closest dynamic ancestor and that ancestor"""
+        self.ensure_one()
+        names = []
+        for node in reversed(self._ancestors()[1:]):
+            if node.model_id:
+                return names, node
+            names.insert(0, node.name)
+        return names, self.browse()
+
+    def _listing_paths(self):
+        """Return directories that contain all entries listed by this node"""
+        self.ensure_one()
+        names, ancestor = self._static_ancestors()
+        if ancestor:
+            return ancestor._listing_paths()
+        return [str(PurePosixPath('/', *names))]
+
+    def _record_paths(self, model_id):
+        """Return the paths of a record listed by this node
+
+            When the node lists its records below every record of a dynamic ancestor the directories of that
+            ancestor are returned instead.
+        """
+        self.ensure_one()
+        names, ancestor = self._static_ancestors()
+        parent_model_id = None
+        prefixes = ['/']
+        if ancestor:
+            if not self.parent_field_id:
+                return ancestor._listing_paths()
+            value = model_id[self.parent_field_id.name]
+            parent_res_id = value.id if isinstance(value, models.BaseModel) else value
+            parent_model_id = self.env[ancestor.res_model].browse(parent_res_id or []).exists()
+            if not parent_model_id:
+                return []
+            prefixes = ancestor._record_paths(parent_model_id)
+        name = self.name if self.aggregate else self._render_name(model_id, parent_model_id)
+        return [str(PurePosixPath(prefix, *names, name)) for prefix in prefixes]
+
+    def _parent_res_model(self):
+        """The model of the closest ancestor with a model, this is the parent record passed to find_node"""
+        self.ensure_one()
+        dynamic = self._ancestors().filtered('model_id')
+        return dynamic[-1:].model_id.model
+
+    def _parent_res_id(self, parent_model_id=None):
+        """The parent record id used to key fuse.path_index"""
+        self.ensure_one()
+        return parent_model_id.id if self.parent_field_id and parent_model_id else 0
+
+    def _path_index_values(self, model_id):
+        self.ensure_one()
+        parent_model_id = None
+        parent_model = self._parent_res_model()
+        if self.parent_field_id and parent_model:
+            value = model_id[self.parent_field_id.name]
+            parent_res_id = value.id if isinstance(value, models.BaseModel) else value
+            parent_model_id = self.env[parent_model].sudo().browse(parent_res_id or [])
+        return {'node_id': self.id,
+                'parent_res_id': self._parent_res_id(parent_model_id),
+                'res_id': model_id.id,
+                'name': self._render_name(model_id, parent_model_id)}
+
+    def _path_index_refresh(self, records):
+        """Recompute the fuse.path_index rows of records for the indexed nodes in self"""
+        index = self.env['fuse.path_index'].sudo()
+        for node in self.sudo():
+            index.search([('node_id', '=', node.id), ('res_id', 'in', records.ids)]).unlink()
+            if not node.use_path_index or node.res_model != records._name:
+                continue
+            members = records.sudo().exists().filtered_domain(node._filter_domain())
+            index.create([node._path_index_values(model_id) for model_id in members])
+
+    def _path_index_rebuild(self):
+        """Recompute all fuse.path_index rows of the nodes in self"""
+        index = self.env['fuse.path_index'].sudo()
+        for node in self.sudo():
+            index.search([('node_id', '=', node.id)]).unlink()
+            if not node.use_path_index or not node.model_id:
+                continue
+            records = self.env[node.res_model].sudo().search(node._filter_domain())
+            index.create([node._path_index_values(model_id) for model_id in records])
+
+    def action_rebuild_path_index(self):
+        self._path_index_rebuild()
+        return True
 
     @api.depends('name', 'model_id')
     def _compute_display_name(self):
@@ -77,49 +602,158 @@ class FUSE(models.Model):
     def _change_parent_model_id(self):
         return {'domain': {'parent_field_id': [('model_id', '=', self.parent_model_id.id)]}}
 
-    @api.depends('name', 'parent_id')
+    @api.depends('name', 'parent_path', 'model_id', 'parent_field_id')
     def _compute_full_path(self):
         for item in self:
             full_path = Path()
-            sitem = item
-            while sitem:
+            # Ancestors are read together from parent_path instead of walking parent_id
+            for sitem in item._ancestors() + item:
                 # TODO: Make full path easier to follow
                 # Format partner/(res.company)/[company_id] <= (res.partner)/[parent_id] <= (res.partner)
                 if sitem.parent_field_id and sitem.parent_model_id:
-                    full_path = Path(f'[{sitem.parent_field_id.name}] <= ({sitem.model_id.model})').joinpath(
-                        full_path)
+                    full_path = full_path.joinpath(f'[{sitem.parent_field_id.name}] <= ({sitem.model_id.model})')
                 elif sitem.model_id:
-                    full_path = Path(f"({sitem.model_id.model})").joinpath(full_path)
+                    full_path = full_path.joinpath(f"({sitem.model_id.model})")
                 else:
-                    full_path = Path(f"{sitem.name}").joinpath(full_path)
-                sitem = sitem.parent_id
+                    full_path = full_path.joinpath(f"{sitem.name}")
             item.full_path = full_path
 
+    def _ancestors(self):
+        """Return the ancestors of the node from the root down, read from parent_path"""
+        self.ensure_one()
+        if not self.parent_path:
+            # Not flushed yet
+            ancestors = self.browse()
+            node = self.parent_id
+            while node:
+                ancestors = node + ancestors
+                node = node.parent_id
+            return ancestors
+        return self.browse([int(node_id) for node_id in self.parent_path.split('/')[:-2]])
+
+    def _base_domain(self, parent_model_id=None):
+        """Domain selecting the records listed by a dynamic node below parent_model_id"""
+        self.ensure_one()
+        domain = []
+        if self.parent_field_id and parent_model_id:
+            domain.extend([(self.parent_field_id.name, '=', parent_model_id.id)])
+        domain.extend(self._filter_domain())
+        return domain
+
+    def _render_name(self, model_id, parent_model_id=None):
+        """Render the file name of a record using name_pattern"""
+        self.ensure_one()
+        path_name = self.name_pattern.format(item=model_id, parent=parent_model_id)
+        return path_name.replace('/', '_')
+
+    def _name_field_domain(self, field_name, value):
+        """Domain matching value against a rendered field, '/' is rendered as '_' so '_' is a wildcard"""
+        field = self.env[self.model_id.model]._fields.get(field_name)
+        if not field or not field.store or field.type not in INVERTIBLE_FIELD_TYPES:
+            return None
+        if field.type == 'integer':
+            if not re.fullmatch(r'-?\d+', value):
+                return expression.FALSE_DOMAIN
+            return [(field_name, '=', int(value))]
+        if '_' in value:
+            like = value.replace('\\', '\\\\').replace('%', '\\%')
+            domain = [(field_name, '=like', like)]
+        else:
+            domain = [(field_name, '=', value)]
+        if value == 'False':
+            domain = expression.OR([domain, [(field_name, '=', False)]])
+        return domain
+
+    def _name_domain(self, path):
+        """Invert name_pattern into a domain that selects the record named path
+
+            Only patterns with a single {item.field} placeholder (and any literal text around it) can be inverted.
+            output: domain - FALSE_DOMAIN if path can never match
+                    None - if the pattern cannot be inverted
+        """
+        self.ensure_one()
+        regex = ''
+        field_name = None
+        parsed = self._compiled().name_pattern
+        if parsed is None:
+            return None
+        for literal, field, spec, conversion in parsed:
+            regex += re.escape(literal.replace('/', '_'))
+            if field is None:
+                continue
+            parts = field.split('.')
+            if field_name or spec or conversion or len(parts) != 2 or parts[0] != 'item':
+                return None
+            field_name = parts[1]
+            regex += '(.*)'
+        if not field_name:
+            return None
+        match = re.fullmatch(regex, path, re.DOTALL)
+        if not match:
+            return expression.FALSE_DOMAIN if self._name_field_domain(field_name, '') is not None else None
+        return self._name_field_domain(field_name, match.group(1))
+
+    def _name_re_domain(self, path):
+        """Use the named groups of name_re_pattern as a domain to narrow down candidates for path
+
+            The result is not authoritative, records must still be checked with _render_name.
+            output: domain or None if name_re_pattern does not apply
+        """
+        self.ensure_one()
+        name_re = self._compiled().name_re
+        if not name_re:
+            return None
+        match = name_re.fullmatch(path)
+        if not match or not match.groupdict():
+            return None
+        domain = []
+        for field_name, value in match.groupdict().items():
+            field_domain = self._name_field_domain(field_name, value or '')
+            if field_domain is None:
+                return None
+            domain = expression.AND([domain, field_domain])
+        return domain
+
     @api.model
     def find_node(self, path, parent_model_id=None, types=['dir']):
         """This function return a node associate with a path
 
             For static return name
-            For dynamic filter using filter_domain and construct name using name_pattern
+            For dynamic filter using filter_domain and the name inverted from name_pattern (or name_re_pattern),
+            only scans all records when the pattern cannot be inverted
             inputs: parent_model_id - Model that is associated with the parent
                     path - The path part to search for
             output: ierr, inode, imodel
         """
-        for node in self.env['fuse.node'].search([('parent_id', '=', self.id)]):
+        for node in self._children():
             # If static node matches then return found with parent_model
-            if not node.model_id and node.name == path:
+            if (not node.model_id or node.aggregate) and node.name == path:
                 return 0, node, parent_model_id  # Static so return parent_model and node
-            elif node.model_id:
-                if not node.filter_domain:
-                    node.filter_domain = '[]'
-                domain = []
-                if node.parent_field_id and parent_model_id:
-                    domain.extend([(node.parent_field_id.name, '=', parent_model_id.id)])
-                domain.extend(eval(node.filter_domain))
-                for model_id in self.env[node.model_id.model].search(domain):
-                    path_name = node.name_pattern.format(item=model_id, parent=parent_model_id)
-                    path_name = path_name.replace('/', '_')
-                    if path_name == path:
+            elif node.model_id and not node.aggregate:
+                model = self.env[node.model_id.model]
+                domain = node._base_domain(parent_model_id)
+                if node.use_path_index:
+                    res_ids = self.env['fuse.path_index'].sudo().lookup(node, node._parent_res_id(parent_model_id),
+                                                                        path)
+                    model_id = model.search(expression.AND([domain, [('id', 'in', res_ids)]]), limit=1) \
+                        if res_ids else None
+                    if model_id:
+                        return 0, node, model_id
+                    continue
+                name_domain = node._name_domain(path)
+                if name_domain is not None:
+                    # Authoritative, '_' acts as a wildcard so all candidates are checked
+                    candidates = model.search(expression.AND([domain, name_domain]),
+                                              limit=None if '_' in path else 1)
+                else:
+                    candidates = model.browse()
+                    re_domain = node._name_re_domain(path)
+                    if re_domain is not None:
+                        candidates = model.search(expression.AND([domain, re_domain]))
+                    if not any(node._render_name(model_id, parent_model_id) == path for model_id in candidates):
+                        candidates = model.search(domain)
+                for model_id in candidates:
+                    if node._render_name(model_id, parent_model_id) == path:
                         return 0, node, model_id
         return errno.ENOENT, None, None
 
@@ -136,50 +770,74 @@ class FUSE(models.Model):
         # Root path is always static so it is skipped
 
         path = Path(path)
+        root_node = self.env.ref('fuse.root_node')
         if path == Path('/'):
-            return self.env.ref('fuse.root_node'), None
+            return root_node, None
 
         parts = path.parts[1:]
         parent_model = None
-        parent_node = self.env.ref('fuse.root_node')
-
-        while len(parts) > 1:
-            # Search all nodes that are attach to the parent_node.
-            # If the node is static match the name field (no model attached.)
-            nodes = self.env['fuse.node'].search([('parent_id', '=', parent_node.id),
-                                                  ('type', '=', 'dir')])
-            ierr, inode, imodel = parent_node.find_node(parts[0], parent_model)
+        parent_node = root_node
+        depth = 0
+
+        # Continue from the longest resolved prefix still in the cache
+        cache = self._path_cache()
+        tree = self._node_tree()
+        version = self._path_version()
+        for depth in range(len(parts), 0, -1):
+            hit = cache.get((self.env.uid, self.env.context.get('lang'), parts[:depth]))
+            if hit and hit[0] is tree and hit[5] == version and time.time() - hit[1] < PATH_CACHE_TIMEOUT:
+                imodel = self.env[hit[3]].browse(hit[4]) if hit[3] else None
+                if imodel is None or imodel.exists():
+                    parent_node = self.browse(hit[2])
+                    parent_model = imodel
+                    break
+        else:
+            depth = 0
+
+        # Search all nodes that are attach to the parent_node.
+        # If the node is static match the name field (no model attached.)
+        for depth in range(depth + 1, len(parts) + 1):
+            types = ['dir', 'file'] if depth == len(parts) else ['dir']
+            ierr, inode, imodel = parent_node.find_node(parts[depth - 1], parent_model, types=types)
             if not inode:
-                break
+                return None, None
             parent_node = inode
             parent_model = imodel
-            parts = parts[1:]
+            cache[(self.env.uid, self.env.context.get('lang'), parts[:depth])] = (
+                tree, time.time(), inode.id, imodel._name if imodel else None, imodel.id if imodel else None,
+                version)
 
-        if len(parts) == 1:
-            ierr, inode, imodel = parent_node.find_node(parts[0], parent_model, types=['dir', 'file'])
-            return inode, imodel
+        return parent_node, parent_model
 
-        return None, None
-
-    def paths(self, parent_model_id=None):
+    def paths(self, parent_model_id=None, after_id=0, limit=None):
         """This function returns all the path meta data associated with a node
 
             For static return metadata for node
             For dynamic filter using filter_domain and construct metadata using name_pattern
             inputs: parent_model - The model of the parent that is associated with this node (the instance of the model)
-            output: list with paths
+                    after_id - Only list records with a higher id, records are listed by id
+                    limit - Maximum number of records to list
+            output: list with paths, res_id is the record id of dynamic entries
         """
 
         # TODO: Add parent filter
 
         path_list = []
-        st_mode = 0
-        if self.type == 'dir':
-            st_mode |= S_IFDIR | S_IXUSR | S_IXGRP | S_IRUSR | S_IRGRP
-        if self.type == 'file':
-            st_mode |= S_IFREG | S_IRUSR | S_IWUSR | S_IRGRP | S_IWGRP
+        st_mode = self._mode()
 
-        if not self.model_id:
+        if self.aggregate:
+            st_size, st_mtime, checksum = self._export_stat(parent_model_id)
+            path_list.append({
+                'filename': self.name,
+                'st_mtime': st_mtime or self.write_date.timestamp(),
+                'st_ctime': self.create_date.timestamp(),
+                'st_atime': st_mtime or self.write_date.timestamp(),
+                'st_size': st_size,
+                'st_mode': st_mode,
+                'checksum': checksum,
+                'res_id': 0,
+                'errno': 0})
+        elif not self.model_id:
             meta1 = {
                 'filename': self.name,
                 'st_mtime': self.write_date.timestamp(),
@@ -187,36 +845,181 @@ class FUSE(models.Model):
                 'st_atime': self.write_date.timestamp(),
                 'st_size': 1024,
                 'st_mode': st_mode,
+                'res_id': 0,
                 'errno': 0}
             path_list.append(meta1)
         else:
-            if not self.filter_domain:
-                self.filter_domain = '[]'
-            domain = []
-            if self.parent_field_id and parent_model_id:
-                domain.extend([(self.parent_field_id.name, '=', parent_model_id.id)])
-            domain.extend(eval(self.filter_domain))
-            for model_id in self.env[self.model_id.model].search(domain):
-                path_name = self.name_pattern.format(item=model_id, parent=parent_model_id)
-                path_name = path_name.replace('/', '_')
-                if 'file_size' in model_id:
-                    st_size = eval(self.file_size,
-                                   {'item': model_id})  # TODO: Change to better solution to determine file size.
-                else:
-                    st_size = 0
-
+            domain = self._base_domain(parent_model_id)
+            if after_id:
+                domain = expression.AND([domain, [('id', '>', after_id)]])
+            entries = self._list_records(domain, parent_model_id, limit=limit)
+            if self._is_report():
+                self._report_sizes(entries)
+                content_meta = {entry['id']: entry for entry in entries}
+            else:
+                content_meta = self._attachment_meta([entry['id'] for entry in entries])
+                if self._size_strategy() == 'attachment':
+                    for entry in entries:
+                        entry['st_size'] = content_meta.get(entry['id'], {}).get('file_size') or 0
+            for entry in entries:
                 meta1 = {
-                    'filename': path_name,
-                    'st_mtime': model_id.write_date.timestamp() if model_id.write_date else 0,
-                    'st_atime': model_id.write_date.timestamp() if model_id.write_date else 0,
-                    'st_ctime': model_id.create_date.timestamp() if model_id.create_date else 0,
-                    'st_size': st_size,
+                    'filename': entry['filename'],
+                    'st_mtime': entry['write_date'].timestamp() if entry['write_date'] else 0,
+                    'st_atime': entry['write_date'].timestamp() if entry['write_date'] else 0,
+                    'st_ctime': entry['create_date'].timestamp() if entry['create_date'] else 0,
+                    'st_size': entry['st_size'],
                     'st_mode': st_mode,
+                    'res_id': entry['id'],
+                    'checksum': content_meta.get(entry['id'], {}).get('checksum') or False,
                     'errno': 0
                 }
+                if entry.get('pending'):
+                    meta1['pending'] = True
                 path_list.append(meta1)
         return path_list
 
+    def _name_fields(self):
+        """Return the fields of item used by name_pattern, None if the pattern needs the records themselves"""
+        self.ensure_one()
+        model = self.env[self.model_id.model]
+        name_fields = []
+        parsed = self._compiled().name_pattern
+        if parsed is None:
+            return None
+        for literal, field, spec, conversion in parsed:
+            if field is None or field.split('.')[0] == 'parent':
+                continue
+            parts = field.split('.')
+            if len(parts) != 2 or parts[0] != 'item':
+                return None
+            field = model._fields.get(parts[1])
+            if not field or field.type in RECORD_FIELD_TYPES:
+                return None
+            name_fields.append(parts[1])
+        return name_fields
+
+    def _size_strategy(self):
+        """Resolve the automatic size strategy, output: attachment, field, script or False"""
+        self.ensure_one()
+        if self.size_strategy != 'auto':
+            return self.size_strategy
+        if self.file_size:
+            return 'script'
+        if self.bin_field and self._attachment_backed():
+            return 'attachment'
+        if 'file_size' in self.env[self.model_id.model]._fields:
+            return 'field'
+        return False
+
+    def _attachment_backed(self):
+        """True if the bin_field is stored in ir.attachment"""
+        self.ensure_one()
+        model = self.env[self.model_id.model]
+        if model._name == 'ir.attachment' and self.bin_field.name == 'datas':
+            return True
+        field = model._fields.get(self.bin_field.name)
+        return bool(field and field.attachment)
+
+    def _size_field(self):
+        """Return the field holding the file size, None if file_size is a script that needs the record and
+        False if the size is not read from the records"""
+        self.ensure_one()
+        model = self.env[self.model_id.model]
+        strategy = self._size_strategy()
+        if strategy == 'field':
+            if self.size_field_id:
+                return self.size_field_id.name
+            return 'file_size' if 'file_size' in model._fields else False
+        if strategy != 'script' or not self.file_size:
+            return False
+        match = re.fullmatch(r'\s*item\.(\w+)\s*', self.file_size)
+        field = match and model._fields.get(match.group(1))
+        if not field or field.type in RECORD_FIELD_TYPES:
+            return None
+        return field.name
+
+    def _eval_size(self, model_id):
+        """File size of a record using the size strategy, binary content is never loaded by the node itself"""
+        self.ensure_one()
+        strategy = self._size_strategy()
+        if strategy == 'script' and self.file_size:
+            return eval_expr(self._compiled().file_size, {'item': model_id})
+        if strategy == 'attachment':
+            return self._attachment_meta(model_id.ids).get(model_id.id, {}).get('file_size') or 0
+        size_field = self._size_field()
+        if size_field:
+            return model_id[size_field] or 0
+        return 0
+
+    def _sql_read(self, domain, field_names, limit=None):
+        """Read stored columns of the records matching domain with a single query, applying access rules"""
+        self.ensure_one()
+        model = self.env[self.model_id.model]
+        model.check_access_rights('read')
+        model._flush_search(domain, fields=field_names)
+        model.flush(field_names + ['write_date', 'create_date'])
+        query = model._where_calc(domain)
+        model._apply_ir_rules(query, 'read')
+        from_clause, where_clause, params = query.get_sql()
+        columns = ', '.join(f'"{model._table}"."{name}"' for name in ['id', 'write_date', 'create_date'] + field_names)
+        where_clause = f'WHERE {where_clause}' if where_clause else ''
+        limit_clause = 'LIMIT %s' % int(limit) if limit else ''
+        self.env.cr.execute(f'SELECT {columns} FROM {from_clause} {where_clause} '
+                            f'ORDER BY "{model._table}".id {limit_clause}', params)
+        rows = self.env.cr.dictfetchall()
+        # NULL columns are returned as the ORM returns them, names render the same as with search_read
+        nulls = {name: 0 if model._fields[name].type in ('integer', 'float', 'monetary') else False
+                 for name in field_names}
+        for row in rows:
+            for name, null in nulls.items():
+                if row[name] is None:
+                    row[name] = null
+        return rows
+
+    def _list_records(self, domain, parent_model_id=None, limit=None):
+        """Read the records listed by a dynamic node loading only the fields used by name_pattern and file_size
+
+            Plain stored columns are read with one SQL query, other fields with one search_read. Patterns or size
+            scripts that need the records themselves are rendered record by record.
+            output: list of {'id', 'filename', 'write_date', 'create_date', 'st_size'}
+        """
+        self.ensure_one()
+        model = self.env[self.model_id.model]
+        names = {}
+        name_fields = self._name_fields()
+        if self.use_path_index:
+            names = self.env['fuse.path_index'].sudo().names(self, self._parent_res_id(parent_model_id),
+                                                             model.search(domain, order='id', limit=limit).ids)
+            name_fields = []
+        size_field = self._size_field()
+
+        if name_fields is None or size_field is None:
+            return [{'id': model_id.id,
+                     'filename': names.get(model_id.id) or self._render_name(model_id, parent_model_id),
+                     'write_date': model_id.write_date,
+                     'create_date': model_id.create_date,
+                     'st_size': self._eval_size(model_id) if size_field is not False else 0}
+                    for model_id in model.search(domain, order='id', limit=limit)]
+
+        read_fields = list(set(name_fields + ([size_field] if size_field else [])))
+        if model._log_access and all(model._fields[name].store and model._fields[name].column_type
+                                     and not model._fields[name].translate for name in read_fields):
+            rows = self._sql_read(domain, read_fields, limit=limit)
+        else:
+            rows = model.search_read(domain, read_fields + ['write_date', 'create_date'], order='id', limit=limit)
+        entries = []
+        for row in rows:
+            filename = names.get(row['id'])
+            if not filename:
+                filename = self._render_name(RecordValues(row) if not self.use_path_index else model.browse(row['id']),
+                                             parent_model_id)
+            entries.append({'id': row['id'],
+                            'filename': filename,
+                            'write_date': row['write_date'],
+                            'create_date': row['create_date'],
+                            'st_size': (row[size_field] or 0) if size_field else 0})
+        return entries
+
     @api.model
     def setattr(self, path, attr):
         (node, model) = self.findpath(path)
@@ -228,7 +1031,6 @@ class FUSE(models.Model):
         """return errno, attrs"""
         path = Path(path)
         (node, model) = self.findpath(path)
-        # TODO: Get permissions from odoo
         oattr = {
             'st_mode': 0,
             'st_atime': datetime.timestamp(datetime.now()),
@@ -242,10 +1044,7 @@ class FUSE(models.Model):
             oattr.update({'errno': errno.ENOENT})
             return oattr
 
-        if node.type == 'dir':
-            oattr['st_mode'] |= S_IFDIR | S_IXUSR | S_IXGRP | S_IRUSR | S_IRGRP
-        if node.type == 'file':
-            oattr['st_mode'] |= S_IFREG | S_IRUSR | S_IWUSR | S_IRGRP | S_IWGRP
+        oattr['st_mode'] = node._mode()
         if model and model.create_date:
             oattr['st_ctime'] = model.create_date.timestamp()
         if model and model.write_date:
@@ -257,156 +1056,409 @@ class FUSE(models.Model):
         if node and node.type == 'file':
             oattr['st_size'] = 0
 
-        # Default model.file_size
-        if model and 'file_size' in model:
-            oattr['st_size'] = model.file_size
-
-        # Default node.file_Size
-        if node and node.file_size:
-            oattr['st_size'] = eval(node.file_size,
-                                    {'item': model})
+        # Generated export file, aggregate files are found with the parent record
+        if node._is_export():
+            oattr['st_size'], st_mtime, oattr['checksum'] = node._export_stat(model)
+            if st_mtime:
+                oattr['st_mtime'] = st_mtime
+        # Rendered report, rendered now if the record changed since the last render
+        elif model and node._is_report():
+            cache = self.env['fuse.report.cache']._get(node, model)
+            oattr['st_size'] = cache.file_size
+            oattr['checksum'] = cache.checksum
+        # Size from the size strategy and the content hash when the binary is stored as an attachment
+        elif model and node.model_id:
+            content_meta = node._attachment_meta(model.ids).get(model.id, {}) if node.bin_field else {}
+            if node._size_strategy() == 'attachment':
+                oattr['st_size'] = content_meta.get('file_size') or 0
+            else:
+                oattr['st_size'] = node._eval_size(model)
+            if node.bin_field:
+                oattr['checksum'] = content_meta.get('checksum') or False
 
         return oattr
 
+    @api.model
+    def skeleton(self):
+        """Return the attributes of all static nodes reachable without a record, read in one query
+
+            Clients preload these at mount so the static directory tree never needs a lookup.
+            output: list of attribute dicts with a 'path' key
+        """
+        nodes = {node['id']: node for node in self.search_read([], ['name', 'type', 'model_id', 'parent_path',
+                                                                    'write_date', 'create_date'])}
+        root_node = self.env.ref('fuse.root_node')
+        entries = []
+        for node in nodes.values():
+            ancestor_ids = [int(node_id) for node_id in (node['parent_path'] or '').split('/')[:-1]]
+            chain = [nodes.get(node_id) for node_id in ancestor_ids]
+            if not ancestor_ids or ancestor_ids[0] != root_node.id or any(
+                    not ancestor or ancestor['model_id'] for ancestor in chain):
+                continue
+            st_mode = self._node_mode(node['id'])
+            entries.append({'path': str(PurePosixPath('/', *[ancestor['name'] for ancestor in chain[1:]])),
+                            'st_mtime': node['write_date'].timestamp(),
+                            'st_ctime': node['create_date'].timestamp(),
+                            'st_atime': node['write_date'].timestamp(),
+                            'st_size': 1024 if node['type'] == 'dir' else 0,
+                            'st_mode': st_mode,
+                            'errno': 0})
+        return entries
+
+    @api.model
+    def getattr_many(self, paths):
+        """Return the attributes of all paths in one call
+
+            Paths are resolved parents first so shared path prefixes are resolved once through the findpath cache.
+            output: list of attribute dicts in the order of paths
+        """
+        attrs = {}
+        for path in sorted(set(paths), key=lambda path: len(Path(path).parts)):
+            attrs[path] = self.getattr(path)
+        return [attrs[path] for path in paths]
+
     @api.model
     def readdir(self, path):
-        # TODO: Speedup directory listing
+        """Return all entries of a directory, see readdir_page"""
+        ierr, dirents, cursor = self.readdir_page(path, limit=None)
+        return ierr, dirents
+
+    @api.model
+    def readdir_page(self, path, cursor=False, limit=READDIR_PAGE_SIZE):
+        """Return a page of directory entries
+
+            Entries are ordered by child node and record id so pages stay stable while records are added.
+            inputs: path - The directory path
+                    cursor - The continuation token returned by the previous page, False for the first page
+                    limit - Maximum number of entries, None for all entries
+            output: ierr, dirents, cursor - cursor is False when there are no more entries
+        """
         ierr = 0
         path = Path(path)
         dirnode, parent_model = self.findpath(path)
-        dirents = [{'filename': '.',
-                    'st_mode': S_IFDIR | S_IXUSR | S_IXGRP | S_IRUSR | S_IRGRP,
-                    'st_atime': dirnode.write_date.timestamp(),
-                    'st_mtime': dirnode.write_date.timestamp(),
-                    'st_ctime': dirnode.create_date.timestamp(),
-                    'st_size': 1024,
-                    'st_size': 1024,
-                    'errno': 0},
-                   {'filename': '..',
-                    'st_mode': S_IFDIR | S_IXUSR | S_IXGRP | S_IRUSR | S_IRGRP,
-                    'st_atime': dirnode.write_date.timestamp(),
-                    'st_mtime': dirnode.write_date.timestamp(),
-                    'st_ctime': dirnode.create_date.timestamp(),
-                    'st_size': 1024,
-                    'errno': 0}]
-
-        fuse_error = 0
-        if dirnode and dirnode.type == 'dir':
-            dirnodes = self.env['fuse.node'].search([('parent_id', '=', dirnode.id)])
-            for node in dirnodes:
-                dirents.extend(node.paths(parent_model))
-        else:
-            ierr = errno.ENOTDIR
-        return ierr, dirents
+        if not dirnode:
+            return errno.ENOENT, [], False
+        if dirnode.type != 'dir':
+            return errno.ENOTDIR, [], False
+
+        dirents = []
+        if not cursor:
+            dirents = [{'filename': '.',
+                        'st_mode': dirnode._mode(),
+                        'st_atime': dirnode.write_date.timestamp(),
+                        'st_mtime': dirnode.write_date.timestamp(),
+                        'st_ctime': dirnode.create_date.timestamp(),
+                        'st_size': 1024,
+                        'errno': 0},
+                       {'filename': '..',
+                        'st_mode': (dirnode.parent_id or dirnode)._mode(),
+                        'st_atime': dirnode.write_date.timestamp(),
+                        'st_mtime': dirnode.write_date.timestamp(),
+                        'st_ctime': dirnode.create_date.timestamp(),
+                        'st_size': 1024,
+                        'errno': 0}]
 
+        # The cursor is "node id:record id", the child node to resume at and the last record id it returned
+        cursor_node_id, cursor_res_id = map(int, cursor.split(':')) if cursor else (0, 0)
+        for node in dirnode._children():
+            if node.id < cursor_node_id:
+                continue
+            after_id = cursor_res_id if node.id == cursor_node_id else 0
+            remaining = limit - len(dirents) if limit else None
+            if remaining is not None and remaining <= 0:
+                return ierr, dirents, f'{node.id}:{after_id}'
+            entries = node.paths(parent_model, after_id=after_id, limit=remaining)
+            dirents.extend(entries)
+            if node.model_id and not node.aggregate and remaining is not None and len(entries) == remaining:
+                return ierr, dirents, f'{node.id}:{entries[-1]["res_id"]}'
+        return ierr, dirents, False
+
+    # Single operations run through batch so access errors are returned as EACCES
     @api.model
     def rmdir(self, path):
-        ierr = 0
-        path = Path(path)
-        dirnode, imodel = self.findpath(path)
-        if dirnode.type == 'dir':
-            if imodel:
-                imodel.unlink()
-                return 0
-            else:
-                return errno.ENOENT
+        return self.batch([['rmdir', path]])[0]
 
     @api.model
     def mkdir(self, path):
+        return self.batch([['mkdir', path]])[0]
+
+    @api.model
+    def fs_unlink(self, path):
+        """Remove the file at path, named fs_unlink as unlink deletes nodes"""
+        return self.batch([['unlink', path]])[0]
+
+    @api.model
+    def rename(self, old, new):
+        return self.batch([['rename', old, new]])[0]
+
+    @api.model
+    def file_create(self, path):
+        return self.batch([['create', path]])[0]
+
+    @api.model
+    def batch(self, ops):
+        """Run filesystem operations in one transaction
+
+            Directories are resolved once for all operations. Each operation runs in its own savepoint so a failed
+            operation is rolled back without affecting the others.
+            input: ops - list of [operation, path] or ['rename', old, new], operation is one of mkdir, create,
+                         unlink, rmdir or rename
+            output: list with the errno of each operation
+        """
+        handlers = {'mkdir': self._mkdir,
+                    'create': self._file_create,
+                    'unlink': self._unlink,
+                    'rmdir': self._rmdir,
+                    'rename': self._rename}
+        resolved = {}
+        results = []
+        for op in ops:
+            handler = handlers.get(op[0])
+            if not handler:
+                results.append(errno.ENOSYS)
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    ierr = handler(*op[1:], resolved=resolved)
+                    self.flush()
+            except (AccessError, UserError, ValidationError, ValueError, psycopg2.Error) as e:
+                ierr = errno.EACCES if isinstance(e, AccessError) else errno.EINVAL
+                # Records created or changed by the failed operation are gone
+                self.env.clear()
+                resolved.clear()
+            results.append(ierr)
+        return results
+
+    def _resolve(self, path, resolved=None):
+        """findpath of a directory, resolved memoizes directories for the operations of a batch"""
+        path = Path(path)
+        if resolved is None:
+            return self.findpath(path)
+        if path not in resolved:
+            resolved[path] = self.findpath(path)
+        return resolved[path]
+
+    def _resolve_entry(self, path, resolved=None):
+        """findpath of a directory entry, the parent directory is resolved through _resolve"""
+        path = Path(path)
+        if resolved is None or path == path.parent:
+            return self.findpath(path)
+        parent_node, parent_model = self._resolve(path.parent, resolved)
+        if not parent_node:
+            return None, None
+        ierr, inode, imodel = parent_node.find_node(path.name, parent_model, types=['dir', 'file'])
+        return inode, imodel
+
+    def _forget(self, path, resolved=None):
+        """Drop path and everything below it from the directories resolved by a batch"""
+        if not resolved:
+            return
         path = Path(path)
-        parent_path = path.parent
-        parent_node, parent_model = self.env['fuse.node'].findpath(parent_path)
+        for key in [key for key in resolved if key == path or path in key.parents]:
+            del resolved[key]
+
+    def _rmdir(self, path, resolved=None):
+        dirnode, imodel = self._resolve_entry(path, resolved)
+        if not dirnode:
+            return errno.ENOENT
+        if dirnode.type != 'dir':
+            return errno.ENOTDIR
+        if not imodel or dirnode.aggregate or not dirnode.model_id:
+            return errno.EACCES
+        imodel.unlink()
+        self._forget(path, resolved)
+        return 0
+
+    def _mkdir(self, path, resolved=None):
+        path = Path(path)
+        parent_node, parent_model = self._resolve(path.parent, resolved)
         error = errno.EACCES
         if parent_node and parent_node.type == 'dir':
-            nodes = self.env['fuse.node'].search([('parent_id', '=', parent_node.id),
-                                                  ('type', '=', 'dir')])
+            nodes = parent_node._children(types=['dir'])
             for node in nodes:
-                if node.name_re_pattern and node.model_id:
-                    match1 = re.fullmatch(node.name_re_pattern, str(path.name))
-                    if not match1:
-                        continue
-                    field_values = match1.groupdict()
-                    if parent_model and node.parent_field_id:
-                        field_values.update({node.parent_field_id.name: parent_model.id})
-                    field_values.update(
-                        {field1.field_id.name: eval(field1.field_value) for field1 in node.field_value_ids})
-                    self.env[node.model_id.model].create(field_values)
-                    error = 0
-                    break
+                field_values = node._match_values(path.name, parent_model)
+                if field_values is None:
+                    continue
+                self.env[node.model_id.model].create(field_values)
+                error = 0
+                break
 
         return error
 
-    @api.model
-    def unlink(self, path):
-        ierr = 0
-        path = Path(path)
-        dirnode, imodel = self.findpath(path)
-        if dirnode.type == 'file':
-            if imodel:
-                imodel.unlink()
-                return 0
-            else:
-                return errno.ENOENT
+    def _unlink(self, path, resolved=None):
+        filenode, imodel = self._resolve_entry(path, resolved)
+        if not filenode:
+            return errno.ENOENT
+        if filenode.type != 'file':
+            return errno.EISDIR
+        if not imodel or filenode.aggregate or not filenode.model_id:
+            return errno.EACCES
+        imodel.unlink()
+        return 0
 
-    @api.model
-    def rename(self, old, new):
+    def _rename(self, old, new, resolved=None):
         old_path = Path(old)
         new_path = Path(new)
-        old_node, old_model = self.findpath(old_path)
-        error = errno.EACCES
-        parent_path = new_path.parent
-        parent_node, parent_model = self.env['fuse.node'].findpath(parent_path)
+        old_node, old_model = self._resolve_entry(old_path, resolved)
+        if not old_node:
+            return errno.ENOENT
+        if not old_model or old_node.aggregate or not old_node.model_id:
+            return errno.EACCES
+        parent_node, parent_model = self._resolve(new_path.parent, resolved)
         error = errno.EACCES
         if parent_node and parent_node.type == 'dir':
-            nodes = self.env['fuse.node'].search([('parent_id', '=', parent_node.id)])
+            # Records can move to any node of the same model, only the fields are written so content stays in place
+            nodes = parent_node._children(types=[old_node.type])
             for node in nodes:
-                # check each node for re
                 # TODO: Handle Duplicates
-                if node.name_re_pattern and node.model_id:
-                    match1 = re.fullmatch(node.name_re_pattern, str(new_path.name))
-                    if not match1:
-                        continue
-                    field_values = match1.groupdict()
-                    if parent_model and node.parent_field_id:
-                        field_values.update({node.parent_field_id.name: parent_model.id})
-                        # TODO: Set Default values here
-                    field_values.update(
-                        {field1.field_id.name: eval(field1.field_value) for field1 in node.field_value_ids})
-                    old_model.write(field_values)
-                    error = 0
-                    break
-
+                field_values = node._move_values(old_model, new_path.name, parent_model)
+                if field_values is None:
+                    continue
+                old_model.write(field_values)
+                error = 0
+                break
+        self._forget(old_path, resolved)
         return error
 
-    @api.model
-    def file_create(self, path):
+    def _file_create(self, path, resolved=None):
         # TODO: If no model assigned on parent the use node as parent object
         path = Path(path)
-        parent_path = path.parent
-        parent_node, parent_model = self.env['fuse.node'].findpath(parent_path)
+        parent_node, parent_model = self._resolve(path.parent, resolved)
         error = errno.EACCES
         if parent_node and parent_node.type == 'dir':
-            nodes = self.env['fuse.node'].search([('parent_id', '=', parent_node.id),
-                                                  ('type', '=', 'file')])
+            nodes = parent_node._children(types=['file'])
             for node in nodes:
                 # check each node for re
                 # TODO: Handle Duplicates
-                if node.name_re_pattern and node.model_id:
-                    match1 = re.fullmatch(node.name_re_pattern, str(path.name))
-                    if not match1:
-                        continue
-                    field_values = match1.groupdict()
-                    if parent_model and node.parent_field_id:
-                        field_values.update({node.parent_field_id.name: parent_model.id})
-                        # TODO: Set Default values here
-                    field_values.update(
-                        {field1.field_id.name: eval(field1.field_value) for field1 in node.field_value_ids})
-                    self.env[node.model_id.model].create(field_values)
-                    error = 0
-                    break
+                field_values = node._match_values(path.name, parent_model)
+                if field_values is None:
+                    continue
+                self.env[node.model_id.model].create(field_values)
+                error = 0
+                break
 
         return error
 
+    def _write_content(self, model_id, data, base=0):
+        """Store data (bytes) in the bin_field of model_id, CSV files are applied to the records
+
+            base - st_mtime of the exported file data was edited from, see _import_csv
+            output: errno
+        """
+        self.ensure_one()
+        if self.file_content == 'csv' and self.model_id:
+            return self._import_csv(model_id, data, base)
+        model_id[self.bin_field.name] = b64encode(data)
+        return 0
+
+    def _write_staged(self, model_id, session):
+        """Store the staged file of an upload session (fuse.upload)
+
+            Fields stored as ir.attachment in the filestore are copied from the staged file in blocks so files of
+            any size are stored without loading them, other content is written with _write_content.
+            output: errno
+        """
+        self.ensure_one()
+        attachments = self.env['ir.attachment'].sudo()
+        if not model_id or self._is_export() or not self.bin_field or not self._attachment_backed() \
+                or attachments._storage() != 'file':
+            return self._write_content(model_id, session.read_staged(), session.base)
+        model_id.check_access_rights('write')
+        model_id.check_access_rule('write')
+        size = int(session.offset)
+        sha1 = hashlib.sha1()
+        for data in session.read_blocks():
+            sha1.update(data)
+        checksum = sha1.hexdigest()
+        fname, full_path = attachments._get_path(b'', checksum)
+        if not os.path.exists(full_path):
+            with open(full_path + '.fuse', 'wb') as f:
+                for data in session.read_blocks():
+                    f.write(data)
+            os.replace(full_path + '.fuse', full_path)
+
+        attachment = self._content_attachment(model_id)
+        if not attachment:
+            field = self.bin_field.name
+            attachment = attachments.create({'name': field, 'res_model': model_id._name, 'res_field': field,
+                                             'res_id': model_id.id, 'type': 'binary'})
+        old_fname = attachment.store_fname
+        attachment.write({'store_fname': fname, 'file_size': size, 'checksum': checksum, 'db_datas': False})
+        if old_fname and old_fname != fname:
+            attachment._file_delete(old_fname)
+        model_id.invalidate_cache([self.bin_field.name], model_id.ids)
+        if model_id._name != 'ir.attachment':
+            # Clients notice the change through the write_date of the record
+            model_id.write_date = fields.Datetime.now()
+        return 0
+
+    def _import_csv(self, model_id, data, base=0):
+        """Apply an edited CSV file to the records it was exported from
+
+            The file is compared with the current export and only changed rows are written, records with the same
+            changes are written together. In aggregate files rows without id are created and missing rows are
+            removed. Everything is applied in the current transaction.
+            With base (st_mtime of the export that was edited) records created or changed by others after the export
+            are left as they are, their rows in the file are outdated.
+            output: errno, EINVAL if the file cannot be parsed or refers to records outside the node
+        """
+        self.ensure_one()
+        model = self.env[self.model_id.model]
+        field_names = self._export_fields()
+        writable = [name for name in field_names if name != 'id' and not model._fields[name].readonly]
+        records = self._export_records(model_id)
+        later = set()
+        if base and model._log_access:
+            since = datetime.fromtimestamp(base)
+            later = set(model.search([('id', 'in', records.ids),
+                                      '|', ('create_date', '>', since), ('write_date', '>', since)]).ids)
+        current = {}
+        for start in range(0, len(records), EXPORT_BATCH_SIZE):
+            for row in records[start:start + EXPORT_BATCH_SIZE].read(writable):
+                current[row['id']] = {name: _csv_value(model._fields[name], row[name]) for name in writable}
+
+        try:
+            reader = csv.DictReader(io.StringIO(data.decode('utf-8-sig')))
+            if 'id' not in (reader.fieldnames or []):
+                return errno.EINVAL
+            columns = [name for name in writable if name in reader.fieldnames]
+            to_write = {}
+            to_create = []
+            seen = set()
+            for row in reader:
+                res_id = int(row['id']) if (row['id'] or '').strip() else 0
+                if not res_id:
+                    if not self.aggregate:
+                        return errno.EINVAL
+                    to_create.append({name: _csv_parse(model._fields[name], row[name] or '') for name in columns})
+                    continue
+                if res_id not in current:
+                    return errno.EINVAL
+                seen.add(res_id)
+                if res_id in later:
+                    continue
+                vals = {}
+                for name in columns:
+                    field = model._fields[name]
+                    value = _csv_parse(field, row[name] or '')
+                    if value != _csv_parse(field, current[res_id][name]):
+                        vals[name] = value
+                if vals:
+                    to_write.setdefault(repr(sorted(vals.items())), (vals, []))[1].append(res_id)
+        except (ValueError, UnicodeDecodeError, csv.Error):
+            return errno.EINVAL
+
+        for vals, res_ids in to_write.values():
+            model.browse(res_ids).write(vals)
+        if to_create:
+            defaults = self._default_values()
+            if model_id and self.parent_field_id:
+                defaults[self.parent_field_id.name] = model_id.id
+            model.create([dict(defaults, **vals) for vals in to_create])
+        if self.aggregate:
+            model.browse([res_id for res_id in current if res_id not in seen and res_id not in later]).unlink()
+        return 0
+
     @api.model
     def upload(self, path, bin_data):
         """Receives bin_data in b64 format and loads it into a binary object
@@ -415,19 +1467,296 @@ class FUSE(models.Model):
         path = Path(path)
         inode, imodel = self.findpath(path)
         if imodel and inode and inode.bin_field:
-            exec(f'imodel.{inode.bin_field.name} = bin_data')
+            imodel[inode.bin_field.name] = bin_data
+
+    @api.model
+    def upload_begin(self, path, size=0, stamp=0, base=0):
+        """Start or resume a chunked upload
+
+            A session of the same user for the same path, size and stamp is resumed from its acknowledged offset.
+            input: path, size - Size of the file, stamp - Client modification time of the file,
+                   base - st_mtime of the file the client edited, records changed after it are left as they are
+            output: {'errno', 'token', 'offset'}
+        """
+        inode, imodel = self.findpath(path)
+        if not inode:
+            return {'errno': errno.ENOENT, 'token': False, 'offset': 0}
+        if not (imodel or inode.aggregate) or not inode._mode() & S_IWUSR:
+            return {'errno': errno.EACCES, 'token': False, 'offset': 0}
+        res_model = imodel._name if imodel else inode.res_model
+        res_id = imodel.id if imodel else 0
+        uploads = self.env['fuse.upload']
+        session = uploads.search([('path', '=', str(path)), ('create_uid', '=', self.env.uid)], limit=1)
+        if session and (session.size != size or session.stamp != stamp or session.base != base
+                        or session.res_id != res_id):
+            session.unlink()
+            session = uploads
+        if not session:
+            session = uploads.create({'path': str(path), 'node_id': inode.id, 'res_model': res_model,
+                                      'res_id': res_id, 'size': size, 'stamp': stamp, 'base': base})
+        return {'errno': 0, 'token': session.token, 'offset': int(session.offset)}
+
+    @api.model
+    def upload_chunk(self, token, offset, bin_data):
+        """Append a b64 encoded chunk at offset to an upload session
+
+            output: {'errno', 'offset'} - EINVAL if offset is not the acknowledged offset, the client resumes at offset
+        """
+        session = self.env['fuse.upload']._find(token)
+        if not session:
+            return {'errno': errno.ENOENT, 'offset': 0}
+        if not session.append(offset, b64decode(bin_data or b'')):
+            return {'errno': errno.EINVAL, 'offset': int(session.offset)}
+        return {'errno': 0, 'offset': int(session.offset)}
+
+    @api.model
+    def upload_commit(self, token):
+        """Store the staged chunks of an upload session in the binary field (or apply them to CSV records)
+
+            output: errno
+        """
+        session = self.env['fuse.upload']._find(token)
+        if not session:
+            return errno.ENOENT
+        # Aggregate files at the top level have no record
+        model_id = self.env[session.res_model].browse(session.res_id).exists() if session.res_id else None
+        if session.res_id and not model_id:
+            return errno.ENOENT
+        try:
+            with self.env.cr.savepoint():
+                ierr = session.node_id._write_staged(model_id, session)
+                self.flush()
+        except AccessError:
+            self.env.clear()
+            ierr = errno.EACCES
+        session.unlink()
+        return ierr
+
+    def _content_attachment(self, model_id):
+        """Return the ir.attachment holding the bin_field of model_id, empty if the field is stored in the table"""
+        self.ensure_one()
+        attachments = self.env['ir.attachment'].sudo()
+        if self._is_report() and model_id:
+            report_cache = self.env['fuse.report.cache']
+            return report_cache._content_attachment(report_cache._get(self, model_id))
+        if not self.bin_field or not model_id:
+            return attachments
+        if model_id._name == 'ir.attachment' and self.bin_field.name == 'datas':
+            return model_id.sudo()
+        field = model_id._fields.get(self.bin_field.name)
+        if not field or not field.attachment:
+            return attachments
+        return attachments.search([('res_model', '=', model_id._name),
+                                   ('res_field', '=', field.name),
+                                   ('res_id', '=', model_id.id)], limit=1)
+
+    def _is_report(self):
+        self.ensure_one()
+        return self.file_content == 'report' and bool(self.report_id)
+
+    def _is_export(self):
+        """True if the content of the files is generated from the exported fields (json_fields)"""
+        self.ensure_one()
+        return self.file_content in ('json', 'csv') and bool(self.model_id)
+
+    def _is_writable(self):
+        """True if file content written by clients can be stored"""
+        self.ensure_one()
+        return bool(self.bin_field) or (self.file_content == 'csv' and bool(self.model_id))
+
+    def _has_content(self):
+        """True if files of this node have content that can be downloaded"""
+        self.ensure_one()
+        return bool(self.bin_field) or self._is_report() or self._is_export()
+
+    def _export_fields(self):
+        """Names of the exported fields, id and display_name when no json_fields are selected"""
+        self.ensure_one()
+        names = self.json_fields.filtered(lambda field: field.model == self.model_id.model).mapped('name')
+        if not names:
+            return ['id', 'display_name']
+        return ['id'] + [name for name in names if name != 'id']
+
+    def _export_records(self, model_id):
+        """Records in the export file of model_id, all records listed below model_id for aggregate files"""
+        self.ensure_one()
+        if self.aggregate:
+            return self.env[self.model_id.model].search(self._base_domain(model_id), order='id')
+        return model_id
+
+    def _export_chunks(self, records):
+        """Generate the export file of records as bytes chunks, records are read EXPORT_BATCH_SIZE at a time"""
+        self.ensure_one()
+        if self.file_content == 'csv':
+            return self._csv_chunks(records)
+        return self._json_chunks(records)
+
+    def _csv_chunks(self, records):
+        self.ensure_one()
+        field_names = self._export_fields()
+        model_fields = self.env[self.model_id.model]._fields
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(field_names)
+        for start in range(0, len(records), EXPORT_BATCH_SIZE):
+            batch = records[start:start + EXPORT_BATCH_SIZE]
+            for row in batch.read(field_names):
+                writer.writerow([_csv_value(model_fields[name], row[name]) for name in field_names])
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            batch.invalidate_cache(ids=batch.ids)
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+    def _json_chunks(self, records):
+        self.ensure_one()
+        field_names = self._export_fields()
+        if not self.aggregate:
+            rows = records[:1].read(field_names)
+            yield json.dumps(rows[0] if rows else {}, default=_json_default).encode()
+            return
+        yield b'['
+        for start in range(0, len(records), EXPORT_BATCH_SIZE):
+            batch = records[start:start + EXPORT_BATCH_SIZE]
+            data = ','.join(json.dumps(row, default=_json_default) for row in batch.read(field_names))
+            yield (',' + data if start else data).encode()
+            batch.invalidate_cache(ids=batch.ids)
+        yield b']'
+
+    def _export_file(self, model_id):
+        """Generate the export file of model_id into a temporary file
+
+            output: file positioned at 0, size, sha1 checksum
+        """
+        self.ensure_one()
+        f = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        sha1 = hashlib.sha1()
+        for data in self._export_chunks(self._export_records(model_id)):
+            f.write(data)
+            sha1.update(data)
+        size = f.tell()
+        f.seek(0)
+        return f, size, sha1.hexdigest()
+
+    def _export_stat(self, model_id):
+        """Size, modification time and checksum of an export file
+
+            Clients read no further than the size, it must be exact. Aggregate files are generated once per version
+            of their records, the size and checksum are cached by the number of records and the latest write_date.
+        """
+        self.ensure_one()
+        if not self.aggregate:
+            if not model_id:
+                return 0, 0, False
+            f, size, checksum = self._export_file(model_id)
+            f.close()
+            return size, model_id.write_date.timestamp() if model_id.write_date else 0, checksum
+        model = self.env[self.model_id.model]
+        domain = self._base_domain(model_id)
+        latest = model.search(domain, order='write_date desc, id desc', limit=1)
+        key = (self.id, self.write_date, model_id.id if model_id else 0, self.env.uid, self.env.context.get('lang'),
+               model.search_count(domain), latest.id, latest.write_date)
+        cache = self._export_cache()
+        stat = cache.get(key)
+        if stat is None:
+            f, size, checksum = self._export_file(model_id)
+            f.close()
+            stat = cache[key] = (size, checksum)
+        return stat[0], latest.write_date.timestamp() if latest.write_date else 0, stat[1]
+
+    def _report_sizes(self, entries):
+        """Set st_size and checksum of list entries from the rendered reports
+
+            Records without a report rendered at their current write_date are marked pending, their size is known
+            after a getattr (which renders the report).
+        """
+        self.ensure_one()
+        rendered = self.env['fuse.report.cache'].lookup(self, [entry['id'] for entry in entries])
+        for entry in entries:
+            cache = rendered.get(entry['id'])
+            if cache and cache['record_date'] == entry['write_date']:
+                entry['st_size'] = cache['file_size']
+                entry['checksum'] = cache['checksum']
+            else:
+                entry['st_size'] = 0
+                entry['pending'] = True
+
+    def _attachment_meta(self, res_ids):
+        """Read checksum and file_size of the attachments holding the bin_field of res_ids in one query
+
+            output: {res_id: {'checksum', 'file_size'}}, records without an attachment are left out
+        """
+        self.ensure_one()
+        if not self.bin_field or not res_ids:
+            return {}
+        attachments = self.env['ir.attachment'].sudo()
+        model = self.env[self.model_id.model]
+        if model._name == 'ir.attachment' and self.bin_field.name == 'datas':
+            rows = attachments.search_read([('id', 'in', res_ids)], ['checksum', 'file_size'])
+            return {row['id']: row for row in rows}
+        field = model._fields.get(self.bin_field.name)
+        if not field or not field.attachment:
+            return {}
+        rows = attachments.search_read([('res_model', '=', model._name),
+                                        ('res_field', '=', field.name),
+                                        ('res_id', 'in', res_ids)], ['res_id', 'checksum', 'file_size'])
+        return {row['res_id']: row for row in rows}
+
+    def _content_source(self, model_id):
+        """Describe where the content of model_id comes from, used to stream it over HTTP
+
+            output: {'path': filestore path or False, 'data': bytes if not in the filestore, 'size', 'checksum',
+                     'file': temporary file of generated content, 'ranges': False if ranges cannot be served}
+        """
+        self.ensure_one()
+        if self._is_export():
+            f, size, checksum = self._export_file(model_id)
+            return {'path': False, 'data': None, 'file': f, 'size': size, 'checksum': checksum, 'ranges': False}
+        attachment = self._content_attachment(model_id)
+        if attachment and attachment.store_fname:
+            full_path = attachment._full_path(attachment.store_fname)
+            return {'path': full_path, 'data': None, 'size': os.path.getsize(full_path),
+                    'checksum': attachment.checksum}
+        data = self._read_content(model_id)
+        return {'path': False, 'data': data, 'size': len(data), 'checksum': hashlib.sha1(data).hexdigest()}
+
+    def _read_content(self, model_id, offset=0, length=None):
+        """Read length bytes at offset of the bin_field of model_id
+
+            Filestore attachments are read with a seek so the rest of the file is never loaded.
+        """
+        self.ensure_one()
+        if self._is_export():
+            with self._export_file(model_id)[0] as f:
+                f.seek(offset)
+                return f.read() if length is None else f.read(length)
+        attachment = self._content_attachment(model_id)
+        if attachment and attachment.store_fname:
+            with open(attachment._full_path(attachment.store_fname), 'rb') as f:
+                f.seek(offset)
+                return f.read() if length is None else f.read(length)
+        if attachment:
+            data = attachment.db_datas or b''
+        else:
+            data = b64decode(model_id[self.bin_field.name] or b'')
+        return data[offset:] if length is None else data[offset:offset + length]
 
     @api.model
-    def download(self, path):
+    def download(self, path, offset=0, length=None):
         """Opens and returns the binary data store in object references by path
         input: path
+               offset, length - Range to return, the whole file by default
         output: obin - Binary object BASE64 encoded.
                         {'st_ctime', 'st_mtime', 'st_atime', 'st_size', 'st_mode'
                       """
         path = Path(path)
         inode, imodel = self.findpath(path)
-        if imodel and inode and inode.bin_field:
-            ibin = eval(f'imodel.{inode.bin_field.name}')
+        if inode and (imodel or inode.aggregate) and inode._has_content():
+            if not offset and length is None and inode.bin_field:
+                ibin = imodel[inode.bin_field.name]
+            else:
+                ibin = b64encode(inode._read_content(imodel, offset, length))
         else:
             ibin = None
         return ibin
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, tools
+
+
+class FUSEPathIndex(models.Model):
+    _name = 'fuse.path_index'
+    _description = 'Rendered file names of dynamic nodes, maintained when the records change'
+    _rec_name = 'name'
+
+    node_id = fields.Many2one('fuse.node', required=True, ondelete='cascade', index=True)
+    parent_res_id = fields.Integer('Parent Record', help='Record of the parent model, 0 if the node has no parent field')
+    res_id = fields.Integer('Record', required=True, index=True)
+    name = fields.Char('Filename', required=True)
+
+    def init(self):
+        tools.create_index(self._cr, 'fuse_path_index_lookup_idx', self._table,
+                           ['node_id', 'parent_res_id', 'name'])
+
+    @api.model
+    def lookup(self, node, parent_res_id, name):
+        """Return the record ids named name below parent_res_id"""
+        rows = self.search([('node_id', '=', node.id),
+                            ('parent_res_id', '=', parent_res_id or 0),
+                            ('name', '=', name)])
+        return rows.mapped('res_id')
+
+    @api.model
+    def names(self, node, parent_res_id, res_ids):
+        """Return {res_id: name} for the indexed records of node"""
+        rows = self.search_read([('node_id', '=', node.id),
+                                 ('parent_res_id', '=', parent_res_id or 0),
+                                 ('res_id', 'in', res_ids)], ['res_id', 'name'])
+        return {row['res_id']: row['name'] for row in rows}
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from odoo.osv import expression
+from base64 import b64encode
+from datetime import timedelta
+import hashlib
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Maximum number of reports rendered per node by one run of the pre-render job
+REPORT_PRERENDER_LIMIT = 200
+
+
+class FUSEReportCache(models.Model):
+    _name = 'fuse.report.cache'
+    _description = 'Rendered report of a record, valid while the record write_date is unchanged'
+
+    node_id = fields.Many2one('fuse.node', required=True, ondelete='cascade', index=True)
+    res_model = fields.Char('Model', required=True)
+    res_id = fields.Integer('Record ID', required=True, index=True)
+    record_date = fields.Datetime('Record Modified', help='write_date of the record when the report was rendered')
+    content = fields.Binary(attachment=True)
+    file_size = fields.Integer()
+    checksum = fields.Char()
+
+    @api.model
+    def lookup(self, node, res_ids):
+        """Return the rendered reports of res_ids keyed by res_id, the caller compares record_date"""
+        rows = self.sudo().search_read([('node_id', '=', node.id), ('res_id', 'in', list(res_ids))],
+                                       ['res_id', 'record_date', 'file_size', 'checksum'], order='id')
+        return {row['res_id']: row for row in rows}
+
+    @api.model
+    def _get(self, node, record):
+        """Return the cache entry of record, the report is rendered when the record changed since the last render"""
+        cache = self.sudo().search([('node_id', '=', node.id), ('res_id', '=', record.id)], order='id desc',
+                                   limit=1)
+        if cache and cache.record_date == record.write_date:
+            return cache
+        return self._render(node, record, cache)
+
+    @api.model
+    def _render(self, node, record, cache=None):
+        record_date = record.write_date
+        content, report_format = node.report_id.render(record.ids)
+        if isinstance(content, str):
+            content = content.encode()
+        vals = {'node_id': node.id,
+                'res_model': record._name,
+                'res_id': record.id,
+                'record_date': record_date,
+                'content': b64encode(content),
+                'file_size': len(content),
+                'checksum': hashlib.sha1(content).hexdigest()}
+        if cache:
+            cache.sudo().write(vals)
+            return cache.sudo()
+        return self.sudo().create(vals)
+
+    @api.model
+    def _content_attachment(self, cache):
+        return self.env['ir.attachment'].sudo().search([('res_model', '=', self._name),
+                                                        ('res_field', '=', 'content'),
+                                                        ('res_id', '=', cache.id)], limit=1)
+
+    @api.model
+    def _invalidate(self, res_model, res_ids):
+        self.sudo().search([('res_model', '=', res_model), ('res_id', 'in', list(res_ids))]).unlink()
+
+    @api.model
+    def _prerender(self):
+        """Render the reports of records modified in the last fuse.report_prerender_hours (default 24)"""
+        hours = int(self.env['ir.config_parameter'].sudo().get_param('fuse.report_prerender_hours', 24))
+        since = fields.Datetime.now() - timedelta(hours=hours)
+        nodes = self.env['fuse.node'].sudo().search([('file_content', '=', 'report'),
+                                                     ('report_id', '!=', False),
+                                                     ('model_id', '!=', False)])
+        for node in nodes:
+            model = self.env[node.res_model].sudo()
+            domain = expression.AND([node._filter_domain(), [('write_date', '>=', since)]])
+            records = model.search(domain, order='write_date desc', limit=REPORT_PRERENDER_LIMIT)
+            rendered = self.lookup(node, records.ids)
+            for record in records:
+                cache = rendered.get(record.id)
+                if cache and cache['record_date'] == record.write_date:
+                    continue
+                try:
+                    with self.env.cr.savepoint():
+                        self._render(node, record, self.browse(cache['id']) if cache else None)
+                except Exception:
+                    _logger.exception('Rendering %s for %s,%s failed', node.report_id.name, record._name, record.id)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from odoo.tools import config
+import os
+import uuid
+
+
+class FUSEUpload(models.TransientModel):
+    _name = 'fuse.upload'
+    _description = 'Upload session staging file chunks until they are committed to the binary field'
+
+    token = fields.Char('Token', required=True, index=True, default=lambda self: uuid.uuid4().hex)
+    path = fields.Char('Path', required=True)
+    node_id = fields.Many2one('fuse.node', required=True, ondelete='cascade')
+    res_model = fields.Char('Model', required=True)
+    res_id = fields.Integer('Record', help='0 for aggregate files without a parent record')
+    # Float (float8) columns, int4 overflows for files of 2 GiB and more
+    size = fields.Float('Size', help='Size announced by the client')
+    stamp = fields.Float('Stamp', help='Client modification time of the uploaded file')
+    base = fields.Float('Base', help='Modification time on odoo of the content the client edited, 0 if unknown')
+    offset = fields.Float('Acknowledged Offset', default=0)
+
+    def _staging_path(self):
+        self.ensure_one()
+        return os.path.join(config.filestore(self.env.cr.dbname), 'fuse_upload', self.token)
+
+    @api.model
+    def _find(self, token):
+        return self.search([('token', '=', token), ('create_uid', '=', self.env.uid)], limit=1)
+
+    def append(self, offset, data):
+        """Append data at offset, data is only appended when offset is the acknowledged offset
+
+            output: True if data was appended
+        """
+        self.ensure_one()
+        acknowledged = int(self.offset)
+        if offset != acknowledged:
+            return False
+        staging_path = self._staging_path()
+        os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+        with open(staging_path, 'r+b' if os.path.exists(staging_path) else 'w+b') as f:
+            # Drop bytes written by a chunk whose transaction did not commit
+            f.truncate(acknowledged)
+            f.seek(acknowledged)
+            f.write(data)
+        self.offset = acknowledged + len(data)
+        return True
+
+    def read_blocks(self, block_size=1024 * 1024):
+        """Yield the acknowledged bytes of the staged file in blocks"""
+        self.ensure_one()
+        staging_path = self._staging_path()
+        if not os.path.exists(staging_path):
+            return
+        remaining = int(self.offset)
+        with open(staging_path, 'rb') as f:
+            while remaining > 0:
+                data = f.read(min(block_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+    def read_staged(self):
+        self.ensure_one()
+        staging_path = self._staging_path()
+        if not os.path.exists(staging_path):
+            return b''
+        with open(staging_path, 'rb') as f:
+            return f.read(int(self.offset))
+
+    def unlink(self):
+        staging_paths = [upload._staging_path() for upload in self]
+        res = super(FUSEUpload, self).unlink()
+        for staging_path in staging_paths:
+            if os.path.exists(staging_path):
+                os.unlink(staging_path)
+        return res
@@ -1,8 +1,11 @@
-from odoo.tests import TransactionCase
+from odoo.tests import TransactionCase, HttpCase
 import errno
 from pathlib import PurePath
 from stat import *
+from unittest.mock import patch
 import base64
+import hashlib
+import json
 
 
 class FuseNodeTesting(TransactionCase):
@@ -66,6 +69,59 @@ class FuseNodeTesting(TransactionCase):
 
         # TODO: Test for failure
 
+    def test_find_node_domain(self):
+        # Patterns with a single field are resolved with a domain, '/' in names are rendered as '_'
+        node1 = self.setup_dynamic_node()
+        node1.name_pattern = 'P-{item.name}'
+        partner1 = self.env['res.partner'].create({'name': 'Some/Partner'})
+        self.assertEqual(node1._name_domain('Other'), [(0, '=', 1)])
+        ierrno, inode, imodel = self.env.ref('fuse.root_node').find_node('P-Some_Partner')
+        self.assertEqual(ierrno, 0)
+        self.assertEqual(inode, node1)
+        self.assertEqual(imodel, partner1)
+
+        ierrno, inode, imodel = self.env.ref('fuse.root_node').find_node('P-Missing Partner')
+        self.assertEqual(ierrno, errno.ENOENT)
+
+        # Patterns that cannot be inverted fall back to scanning
+        node1.name_pattern = '{item.name} - {item.id}'
+        self.assertEqual(node1._name_domain('Some_Partner - 1'), None)
+        ierrno, inode, imodel = self.env.ref('fuse.root_node').find_node(f'Some_Partner - {partner1.id}')
+        self.assertEqual(ierrno, 0)
+        self.assertEqual(imodel, partner1)
+
+    def test_path_index(self):
+        # Indexed nodes answer lookups from fuse.path_index, names follow record changes
+        node1 = self.setup_dynamic_node()
+        node1.write({'name_pattern': '{item.name} - {item.ref}', 'use_path_index': True})
+        partner1 = self.env['res.partner'].create({'name': 'Indexed', 'ref': 'R1'})
+        node1._path_index_refresh(partner1)
+        ierrno, inode, imodel = self.env.ref('fuse.root_node').find_node('Indexed - R1')
+        self.assertEqual(imodel, partner1)
+
+        partner1.ref = 'R2'
+        node1._path_index_refresh(partner1)
+        ierrno, inode, imodel = self.env.ref('fuse.root_node').find_node('Indexed - R1')
+        self.assertEqual(ierrno, errno.ENOENT)
+        paths = [path['filename'] for path in node1.paths()]
+        self.assertTrue('Indexed - R2' in paths)
+
+        node1.use_path_index = False
+        self.assertFalse(self.env['fuse.path_index'].search([('node_id', '=', node1.id)]))
+
+    def test_compiled(self):
+        # Node expressions are compiled once per node version
+        node1 = self.setup_attachment_node()
+        compiled = node1._compiled()
+        self.assertIs(node1._compiled(), compiled)
+        self.assertEqual(node1._filter_domain(), [])
+        self.assertEqual(node1._default_values(), {'res_model': 'res.partner'})
+        self.assertEqual(node1._match_values('file.txt'), {'name': 'file.txt', 'res_model': 'res.partner'})
+
+        node1.filter_domain = "[('res_model', '=', 'res.partner')]"
+        self.assertIsNot(node1._compiled(), compiled)
+        self.assertEqual(node1._filter_domain(), [('res_model', '=', 'res.partner')])
+
     def test_paths(self):
         # Testing paths list all paths on node
 
@@ -85,6 +141,31 @@ class FuseNodeTesting(TransactionCase):
 
         # TODO: Test for meta data
 
+    def test_paths_batched(self):
+        # Plain field patterns are read in one query, other patterns render the records
+        node1 = self.env['fuse.node'].create(
+            {'name': 'Something3', 'model_id': self.env.ref('base.model_res_partner').id,
+             'name_pattern': '{item.name} ({item.id})', 'filter_domain': "[('name', '=like', 'Batched%')]"})
+        parent1 = self.env['res.partner'].create({'name': 'BatchedParent'})
+        partner1 = self.env['res.partner'].create({'name': 'Batched1', 'parent_id': parent1.id})
+        self.assertEqual(node1._name_fields(), ['name', 'id'])
+        paths = [node['filename'] for node in node1.paths()]
+        self.assertEqual(paths, [f'BatchedParent ({parent1.id})', f'Batched1 ({partner1.id})'])
+
+        # Empty columns render as with search_read so listed names can be looked up
+        node1.name_pattern = '{item.name} - {item.ref}'
+        paths = [node['filename'] for node in node1.paths()]
+        self.assertTrue('Batched1 - False' in paths)
+        node1.parent_id = self.env.ref('fuse.root_node')
+        ierrno, inode, imodel = self.env.ref('fuse.root_node').find_node('Batched1 - False')
+        self.assertEqual(ierrno, 0)
+        self.assertEqual(imodel, partner1)
+
+        node1.name_pattern = '{item.parent_id.name} - {item.name}'
+        self.assertEqual(node1._name_fields(), None)
+        paths = [node['filename'] for node in node1.paths()]
+        self.assertTrue('BatchedParent - Batched1' in paths)
+
     def test_getattr(self):
         # Testing getattr
 
@@ -116,6 +197,34 @@ class FuseNodeTesting(TransactionCase):
 
         # Check dynamic file
 
+    def test_mode(self):
+        node1 = self.env['fuse.node'].create({'name': 'Test3',
+                                              'type': 'file',
+                                              'parent_id': self.env.ref('fuse.root_node').id,
+                                              'model_id': self.env.ref('base.model_res_partner').id,
+                                              'bin_field': self.env.ref('base.field_res_partner__image_1920').id,
+                                              'file_content': 'bin'})
+        node2 = self.env['fuse.node'].create({'name': 'Test4',
+                                              'type': 'file',
+                                              'parent_id': self.env.ref('fuse.root_node').id,
+                                              'model_id': self.env.ref('base.model_res_partner').id,
+                                              'file_content': 'json'})
+        self.assertEqual(node1._mode(), S_IFREG | S_IRUSR | S_IWUSR | S_IRGRP | S_IWGRP)
+        self.assertEqual(node2._mode(), S_IFREG | S_IRUSR | S_IRGRP)
+        self.assertTrue(self.env.ref('fuse.root_node')._mode() & S_IWUSR)
+
+        # Users without write access on the model get read only files
+        portal = self.env['res.users'].create({'name': 'FusePortal', 'login': 'fuse_portal',
+                                               'groups_id': [(6, 0, [self.env.ref('base.group_portal').id])]})
+        self.assertFalse(self.env['fuse.node'].with_user(portal)._node_mode(node1.id) & S_IWUSR)
+        self.assertFalse(self.env['fuse.node'].with_user(portal).sudo()._node_mode(node1.id) & S_IWUSR)
+
+    def test_getattr_many(self):
+        node1 = self.setup_static_node()
+        attrs = self.env['fuse.node'].getattr_many(['/Test1', '/', '/Missing', '/Test1'])
+        self.assertEqual([attr['errno'] for attr in attrs], [0, 0, errno.ENOENT, 0])
+        self.assertEqual(attrs[0]['st_mode'], self.env['fuse.node'].getattr('/Test1')['st_mode'])
+
     def test_setattr(self):
         self.env['fuse.node'].setattr('/', {'st_mtime': 10})
         self.assertNotEqual(self.env.ref('fuse.root_node').write_date.timestamp(),
@@ -161,6 +270,70 @@ class FuseNodeTesting(TransactionCase):
 
         # TODO: Find path multi directory dynamic/dynamic
 
+    def test_findpath_cache(self):
+        # Resolved paths are cached and dropped when nodes or records change
+        node1 = self.setup_static_node()
+        node2 = self.env['fuse.node'].create({'name': 'Dir3',
+                                              'parent_id': node1.id,
+                                              'model_id': self.env.ref('base.model_res_partner').id})
+        partner = self.env['res.partner'].create({'name': 'Cached Partner'})
+        inode, imodel = self.env['fuse.node'].findpath('/Test1/Cached Partner')
+        self.assertEqual(imodel, partner)
+        self.assertTrue(self.env['fuse.node']._path_cache().get(
+            (self.env.uid, self.env.context.get('lang'), ('Test1', 'Cached Partner'))))
+
+        partner.name = 'Renamed Partner'
+        self.env['fuse.node']._on_records_changed(partner, 'write')  # Models are only patched once the registry is ready
+        inode, imodel = self.env['fuse.node'].findpath('/Test1/Cached Partner')
+        self.assertEqual(inode, None)
+        inode, imodel = self.env['fuse.node'].findpath('/Test1/Renamed Partner')
+        self.assertEqual(imodel, partner)
+
+        # A rename committed by another worker bumps the shared path version
+        self.env['res.partner'].flush()
+        self.env.cr.execute("UPDATE res_partner SET name = 'Other Worker Partner' WHERE id = %s", [partner.id])
+        self.env['res.partner'].invalidate_cache()
+        self.env.cr.execute("SELECT nextval('fuse_path_seq')")
+        inode, imodel = self.env['fuse.node'].findpath('/Test1/Renamed Partner')
+        self.assertEqual(inode, None)
+        partner.name = 'Renamed Partner'
+
+        node1.name = 'Test2'
+        inode, imodel = self.env['fuse.node'].findpath('/Test1/Renamed Partner')
+        self.assertEqual(inode, None)
+        inode, imodel = self.env['fuse.node'].findpath('/Test2/Renamed Partner')
+        self.assertEqual(inode, node2)
+
+    def test_changes_since(self):
+        # Record changes are journaled with the paths they affect
+        node1 = self.setup_static_node()
+        node2 = self.env['fuse.node'].create({'name': 'Dir3',
+                                              'parent_id': node1.id,
+                                              'model_id': self.env.ref('base.model_res_partner').id})
+        partner = self.env['res.partner'].create({'name': 'Journal Partner'})
+        self.assertEqual(node2._record_paths(partner), ['/Test1/Journal Partner'])
+
+        seq = self.env['fuse.change'].changes_since(0)['seq']
+        old_paths = self.env['fuse.node']._journal_paths(partner)
+        partner.name = 'Journal Partner2'
+        self.env['fuse.node']._on_records_changed(partner, 'write', old_paths)
+        changes = self.env['fuse.change'].changes_since(seq)
+        self.assertFalse(changes['reset'])
+        self.assertTrue('/Test1/Journal Partner' in changes['paths'])
+        self.assertTrue('/Test1/Journal Partner2' in changes['paths'])
+        # Rows younger than the settle time keep seq back, they are returned once
+        self.assertEqual(changes['seq'], seq)
+        self.assertTrue(changes['seen'])
+        self.assertEqual(self.env['fuse.change'].changes_since(changes['seq'], changes['seen'])['paths'], [])
+
+        self.env['ir.config_parameter'].set_param('fuse.change_settle_seconds', 0)
+        changes = self.env['fuse.change'].changes_since(changes['seq'], changes['seen'])
+        self.assertGreater(changes['seq'], seq)
+        self.assertEqual(changes['seen'], [])
+
+        self.env['ir.config_parameter'].set_param('fuse.change_floor', changes['seq'])
+        self.assertTrue(self.env['fuse.change'].changes_since(seq)['reset'])
+
     def test_readdir(self):
         node1 = self.setup_static_node()
         ierr, ipaths = self.env['fuse.node'].readdir('/')
@@ -174,6 +347,218 @@ class FuseNodeTesting(TransactionCase):
         self.assertEqual(ierr, 0)
         self.assert_('PartnerTest' in [i['filename'] for i in ipaths])
 
+    def test_readdir_page(self):
+        # Pages are continued with the cursor until all entries are returned
+        node1 = self.setup_static_node()
+        node2 = self.setup_dynamic_node()
+        node2.write({'name': 'Test2', 'filter_domain': "[('name', '=like', 'PagePartner%')]"})
+        node3 = self.env['fuse.node'].create({'name': 'Test3', 'parent_id': self.env.ref('fuse.root_node').id})
+        for i in range(5):
+            self.env['res.partner'].create({'name': f'PagePartner{i}'})
+        ierr, all_paths = self.env['fuse.node'].readdir('/')
+
+        cursor = False
+        paths = []
+        while True:
+            ierr, ipaths, cursor = self.env['fuse.node'].readdir_page('/', cursor, 2)
+            self.assertEqual(ierr, 0)
+            self.assertLessEqual(len(ipaths), 2)
+            paths.extend(i['filename'] for i in ipaths)
+            if not cursor:
+                break
+        self.assertEqual(paths, [i['filename'] for i in all_paths])
+        self.assertTrue('PagePartner4' in paths and 'Test3' in paths)
+
+    def test_checksum(self):
+        node1 = self.setup_attachment_node()
+        attachment1 = self.env['ir.attachment'].create({'name': 'TestAttach1', 'datas': base64.b64encode(b'123456789')})
+        attr1 = self.env['fuse.node'].getattr('/TestAttach1')
+        self.assertEqual(attr1['checksum'], attachment1.checksum)
+        paths = {path['filename']: path for path in node1.paths()}
+        self.assertEqual(paths['TestAttach1']['checksum'], attachment1.checksum)
+
+    def test_report_cache(self):
+        self.env['ir.ui.view'].create({'name': 'fuse.test_report', 'type': 'qweb', 'key': 'fuse.test_report',
+                                       'arch': '<t t-name="fuse.test_report"><t t-foreach="docs" t-as="o">'
+                                               '<span t-esc="o.name"/></t></t>'})
+        report = self.env['ir.actions.report'].create({'name': 'Test Report',
+                                                       'model': 'res.partner',
+                                                       'report_type': 'qweb-html',
+                                                       'report_name': 'fuse.test_report'})
+        node1 = self.env['fuse.node'].create({'name': 'Test3',
+                                              'type': 'file',
+                                              'parent_id': self.env.ref('fuse.root_node').id,
+                                              'model_id': self.env.ref('base.model_res_partner').id,
+                                              'file_content': 'report',
+                                              'report_id': report.id,
+                                              'name_pattern': '{item.name}.html'})
+        partner1 = self.env['res.partner'].create({'name': 'ReportPartner1'})
+        report_cache = self.env['fuse.report.cache']
+
+        # Listed before rendering, size is known after getattr
+        paths = {path['filename']: path for path in node1.paths()}
+        self.assertTrue(paths['ReportPartner1.html'].get('pending'))
+        attr1 = self.env['fuse.node'].getattr('/ReportPartner1.html')
+        self.assertGreater(attr1['st_size'], 0)
+        self.assertEqual(len(report_cache.lookup(node1, partner1.ids)), 1)
+        paths = {path['filename']: path for path in node1.paths()}
+        self.assertEqual(paths['ReportPartner1.html']['st_size'], attr1['st_size'])
+        self.assertFalse(paths['ReportPartner1.html'].get('pending'))
+        ibin = self.env['fuse.node'].download('/ReportPartner1.html')
+        self.assertIn(b'ReportPartner1', base64.b64decode(ibin))
+        self.assertEqual(len(base64.b64decode(ibin)), attr1['st_size'])
+
+        # A record change invalidates the rendered report
+        node1._on_records_changed(partner1, 'write')
+        self.assertFalse(report_cache.lookup(node1, partner1.ids))
+        report_cache._prerender()
+        self.assertEqual(len(report_cache.lookup(node1, partner1.ids)), 1)
+
+        # Deleting the node drops its rendered reports
+        node1.unlink()
+        self.assertFalse(report_cache.search([('res_model', '=', 'res.partner'), ('res_id', '=', partner1.id)]))
+
+    def test_json_export(self):
+        node1 = self.env['fuse.node'].create({'name': 'Test3',
+                                              'type': 'file',
+                                              'parent_id': self.env.ref('fuse.root_node').id,
+                                              'model_id': self.env.ref('base.model_res_partner').id,
+                                              'file_content': 'json',
+                                              'json_fields': [(6, 0, [self.env.ref('base.field_res_partner__name').id,
+                                                                      self.env.ref('base.field_res_partner__ref').id])],
+                                              'filter_domain': "[('ref', '=', 'FuseJson')]",
+                                              'name_pattern': '{item.name}.json'})
+        partner1 = self.env['res.partner'].create({'name': 'JsonPartner1', 'ref': 'FuseJson'})
+        partner2 = self.env['res.partner'].create({'name': 'JsonPartner2', 'ref': 'FuseJson'})
+
+        ibin = self.env['fuse.node'].download('/JsonPartner1.json')
+        self.assertEqual(json.loads(base64.b64decode(ibin)), {'id': partner1.id, 'name': 'JsonPartner1',
+                                                              'ref': 'FuseJson'})
+        attr1 = self.env['fuse.node'].getattr('/JsonPartner1.json')
+        self.assertEqual(attr1['st_size'], len(base64.b64decode(ibin)))
+
+        # All records in one file, read in batches
+        node1.write({'aggregate': True, 'name': 'partners.json'})
+        self.assertEqual([path['filename'] for path in node1.paths()], ['partners.json'])
+        with patch('odoo.addons.fuse.models.fuse_node.EXPORT_BATCH_SIZE', 1):
+            ibin = self.env['fuse.node'].download('/partners.json')
+        rows = json.loads(base64.b64decode(ibin))
+        self.assertEqual([row['id'] for row in rows], (partner1 | partner2).ids)
+        attr1 = self.env['fuse.node'].getattr('/partners.json')
+        self.assertEqual(attr1['errno'], 0)
+        self.assertEqual(attr1['st_size'], len(base64.b64decode(ibin)))
+        self.assertEqual(attr1['checksum'], hashlib.sha1(base64.b64decode(ibin)).hexdigest())
+
+        # The size stays exact when rows differ in length and after changes
+        partner1.name = 'JsonPartner1 with a much longer name than the others'
+        # A later transaction gets a later write_date
+        self.env['res.partner'].flush()
+        self.env.cr.execute("UPDATE res_partner SET write_date = write_date + interval '1 second' WHERE id = %s",
+                            [partner1.id])
+        self.env['res.partner'].invalidate_cache()
+        ibin = self.env['fuse.node'].download('/partners.json')
+        self.assertEqual(self.env['fuse.node'].getattr('/partners.json')['st_size'], len(base64.b64decode(ibin)))
+        self.assertEqual(node1.paths()[0]['st_size'], len(base64.b64decode(ibin)))
+        self.assertEqual(self.env['fuse.node'].getattr('/JsonPartner1.json')['errno'], errno.ENOENT)
+
+    def test_csv_write_back(self):
+        node1 = self.env['fuse.node'].create({'name': 'partners.csv',
+                                              'type': 'file',
+                                              'parent_id': self.env.ref('fuse.root_node').id,
+                                              'model_id': self.env.ref('base.model_res_partner').id,
+                                              'file_content': 'csv',
+                                              'aggregate': True,
+                                              'json_fields': [(6, 0, [self.env.ref('base.field_res_partner__name').id,
+                                                                      self.env.ref('base.field_res_partner__ref').id])],
+                                              'filter_domain': "[('ref', '=', 'FuseCsv')]",
+                                              'field_value_ids': [(0, 0, {
+                                                  'field_id': self.env.ref('base.field_res_partner__ref').id,
+                                                  'field_value': "'FuseCsv'"})]})
+        partner1 = self.env['res.partner'].create({'name': 'CsvPartner1', 'ref': 'FuseCsv'})
+        partner2 = self.env['res.partner'].create({'name': 'CsvPartner2', 'ref': 'FuseCsv'})
+        partner3 = self.env['res.partner'].create({'name': 'CsvPartner3', 'ref': 'FuseCsv'})
+
+        ibin = base64.b64decode(self.env['fuse.node'].download('/partners.csv'))
+        lines = ibin.decode().splitlines()
+        self.assertEqual(lines[0], 'id,name,ref')
+        self.assertEqual(lines[1], f'{partner1.id},CsvPartner1,FuseCsv')
+
+        # Change partner1, keep partner2, drop partner3 and add a new row
+        data = '\n'.join(['id,name,ref',
+                          f'{partner1.id},CsvPartner1b,FuseCsv',
+                          f'{partner2.id},CsvPartner2,FuseCsv',
+                          ',CsvPartner4,']).encode()
+        session = self.env['fuse.node'].upload_begin('/partners.csv', len(data), 10.0)
+        self.assertEqual(session['errno'], 0)
+        self.env['fuse.node'].upload_chunk(session['token'], 0, base64.b64encode(data))
+        self.assertEqual(self.env['fuse.node'].upload_commit(session['token']), 0)
+        self.assertEqual(partner1.name, 'CsvPartner1b')
+        self.assertEqual(partner2.name, 'CsvPartner2')
+        self.assertFalse(partner3.exists())
+        self.assertEqual(self.env['res.partner'].search([('name', '=', 'CsvPartner4')]).ref, 'FuseCsv')
+
+        # Records created or changed after the export the file was edited from are kept as they are
+        base = partner1.write_date.timestamp()
+        partner5 = self.env['res.partner'].create({'name': 'CsvPartner5', 'ref': 'FuseCsv'})
+        partner2.name = 'CsvPartner2c'
+        self.env['res.partner'].flush()
+        self.env.cr.execute("UPDATE res_partner SET create_date = create_date + interval '1 hour', "
+                            "write_date = write_date + interval '1 hour' WHERE id IN %s",
+                            [(partner2.id, partner5.id)])
+        self.env['res.partner'].invalidate_cache()
+        partner4 = self.env['res.partner'].search([('name', '=', 'CsvPartner4')])
+        data = '\n'.join(['id,name,ref',
+                          f'{partner2.id},CsvPartner2,FuseCsv',
+                          f'{partner4.id},CsvPartner4b,FuseCsv']).encode()
+        self.assertEqual(node1._write_content(None, data, base), 0)
+        self.assertEqual(partner2.name, 'CsvPartner2c')
+        self.assertEqual(partner4.name, 'CsvPartner4b')
+        self.assertTrue(partner5.exists())
+        self.assertFalse(partner1.exists())
+
+        # Rows of records outside the node are rejected
+        data = f'id,name\n{self.env.ref("base.main_partner").id},Changed\n'.encode()
+        self.assertEqual(node1._write_content(None, data), errno.EINVAL)
+        self.assertNotEqual(self.env.ref('base.main_partner').name, 'Changed')
+
+    def test_size_strategy(self):
+        node1 = self.setup_attachment_node()
+        attachment1 = self.env['ir.attachment'].create({'name': 'TestAttach1', 'datas': base64.b64encode(b'123456789')})
+        self.assertEqual(node1._size_strategy(), 'attachment')
+        self.assertEqual(self.env['fuse.node'].getattr('/TestAttach1')['st_size'], 9)
+        paths = {path['filename']: path for path in node1.paths()}
+        self.assertEqual(paths['TestAttach1']['st_size'], 9)
+
+        # Listing never reads the binary field
+        attachment1.invalidate_cache()
+        with patch.object(type(self.env['ir.attachment']), '_compute_datas', side_effect=AssertionError):
+            node1.paths()
+            self.env['fuse.node'].getattr('/TestAttach1')
+
+        node1.write({'size_strategy': 'field', 'size_field_id': self.env.ref('base.field_ir_attachment__file_size').id})
+        self.assertEqual(node1._size_field(), 'file_size')
+        paths = {path['filename']: path for path in node1.paths()}
+        self.assertEqual(paths['TestAttach1']['st_size'], 9)
+
+    def test_skeleton(self):
+        node1 = self.setup_static_node()
+        node2 = self.env['fuse.node'].create({'name': 'Test2', 'type': 'dir', 'parent_id': node1.id})
+        node3 = self.env['fuse.node'].create({'name': 'Test3', 'type': 'dir', 'parent_id': node2.id,
+                                              'model_id': self.env.ref('base.model_res_partner').id})
+        node4 = self.env['fuse.node'].create({'name': 'Test4', 'type': 'dir', 'parent_id': node3.id})
+        self.assertEqual(node2.parent_path, f'{node1.parent_path}{node2.id}/')
+        self.assertEqual(node4._ancestors(), self.env.ref('fuse.root_node') | node1 | node2 | node3)
+        self.assertEqual(node4._static_ancestors(), ([], node3))
+        self.assertEqual(node3._static_ancestors(), (['Test1', 'Test2'], self.env['fuse.node']))
+        self.assertEqual(node4._parent_res_model(), 'res.partner')
+
+        paths = {entry['path']: entry for entry in self.env['fuse.node'].skeleton()}
+        self.assertIn('/', paths)
+        self.assertIn('/Test1/Test2', paths)
+        self.assertTrue(S_ISDIR(paths['/Test1/Test2']['st_mode']))
+        self.assertNotIn('/Test1/Test2/Test3', paths)
+        self.assertFalse([path for path in paths if 'Test4' in path])
+
     def test_download(self):
         # Test Open file
         node1 = self.setup_attachment_node()
@@ -184,6 +569,14 @@ class FuseNodeTesting(TransactionCase):
         ibin = self.env['fuse.node'].download('/TestAttach1')
         self.assertEqual(base64.b64decode(ibin), b'123456789')
 
+        # Check ranges
+        ibin = self.env['fuse.node'].download('/TestAttach1', 2, 3)
+        self.assertEqual(base64.b64decode(ibin), b'345')
+        ibin = self.env['fuse.node'].download('/TestAttach1', 7)
+        self.assertEqual(base64.b64decode(ibin), b'89')
+        ibin = self.env['fuse.node'].download('/TestAttach1', 20, 5)
+        self.assertEqual(base64.b64decode(ibin), b'')
+
         # check if no model (directory)
         ibin = self.env['fuse.node'].download('/')
         self.assertEqual(ibin, None)
@@ -216,6 +609,40 @@ class FuseNodeTesting(TransactionCase):
         self.env['fuse.node'].upload('/TestAttach1', ibin)
         self.assertEqual(attachment1.datas, ibin)
 
+    def test_upload_session(self):
+        node1 = self.setup_attachment_node()
+        attachment1 = self.env['ir.attachment'].create({'name': 'TestAttach1', 'datas': base64.b64encode(b'123')})
+
+        session = self.env['fuse.node'].upload_begin('/TestAttach1', 9, 10.0)
+        self.assertEqual(session['errno'], 0)
+        self.assertEqual(session['offset'], 0)
+        result = self.env['fuse.node'].upload_chunk(session['token'], 0, base64.b64encode(b'98765'))
+        self.assertEqual(result, {'errno': 0, 'offset': 5})
+
+        # Resume from the acknowledged offset
+        resumed = self.env['fuse.node'].upload_begin('/TestAttach1', 9, 10.0)
+        self.assertEqual(resumed['token'], session['token'])
+        self.assertEqual(resumed['offset'], 5)
+        result = self.env['fuse.node'].upload_chunk(session['token'], 2, base64.b64encode(b'4321'))
+        self.assertEqual(result, {'errno': errno.EINVAL, 'offset': 5})
+        result = self.env['fuse.node'].upload_chunk(session['token'], 5, base64.b64encode(b'4321'))
+        self.assertEqual(result, {'errno': 0, 'offset': 9})
+
+        # Attachments in the filestore are stored from the staged file without loading it
+        with patch.object(type(self.env['fuse.upload']), 'read_staged', side_effect=AssertionError):
+            self.assertEqual(self.env['fuse.node'].upload_commit(session['token']), 0)
+        self.assertEqual(base64.b64decode(attachment1.datas), b'987654321')
+        self.assertEqual(attachment1.file_size, 9)
+        self.assertEqual(attachment1.checksum, hashlib.sha1(b'987654321').hexdigest())
+        self.assertEqual(self.env['fuse.node'].upload_commit(session['token']), errno.ENOENT)
+
+        # Sizes beyond the int4 range are stored
+        session = self.env['fuse.node'].upload_begin('/TestAttach1', 3 * 1024 ** 3, 11.0)
+        self.assertEqual(session['errno'], 0)
+        self.env['fuse.upload'].flush()
+        resumed = self.env['fuse.node'].upload_begin('/TestAttach1', 3 * 1024 ** 3, 11.0)
+        self.assertEqual(resumed['token'], session['token'])
+
     def test_create(self):
         node1 = self.setup_dynamic_node()
         node1.type = 'file'
@@ -243,3 +670,108 @@ class FuseNodeTesting(TransactionCase):
         self.assertTrue(partner2)
         self.assertEqual(partner2.name, 'PartnerTest2')
         self.assertEqual(partner2.parent_id, partner1)
+
+    def test_batch(self):
+        node1 = self.setup_dynamic_node()
+        node1.name_re_pattern = '(?P<name>.+)'
+        self.env['fuse.node'].create({'name': 'Test2',
+                                      'model_id': self.env.ref('base.model_res_partner').id,
+                                      'parent_field_id': self.env.ref('base.field_res_partner__parent_id').id,
+                                      'parent_id': node1.id,
+                                      'name_re_pattern': '(?P<name>.+)',
+                                      'type': 'file'})
+        results = self.env['fuse.node'].batch([['mkdir', '/BatchPartner'],
+                                               ['create', '/BatchPartner/BatchChild1'],
+                                               ['create', '/BatchPartner/BatchChild2'],
+                                               ['unlink', '/BatchPartner/BatchChild1'],
+                                               ['rename', '/BatchPartner/BatchChild2', '/BatchPartner/BatchChild3'],
+                                               ['unlink', '/BatchPartner/Missing'],
+                                               ['chmod', '/BatchPartner']])
+        self.assertEqual(results, [0, 0, 0, 0, 0, errno.ENOENT, errno.ENOSYS])
+        partner1 = self.env['res.partner'].search([('name', '=', 'BatchPartner')])
+        self.assertEqual(partner1.child_ids.mapped('name'), ['BatchChild3'])
+        self.assertEqual(self.env['fuse.node'].batch([['rmdir', '/BatchPartner/BatchChild3']]), [errno.ENOTDIR])
+
+    def test_rename_move(self):
+        node1 = self.env['fuse.node'].create({'name': 'Partners',
+                                              'type': 'dir',
+                                              'parent_id': self.env.ref('fuse.root_node').id,
+                                              'model_id': self.env.ref('base.model_res_partner').id,
+                                              'filter_domain': "[('ref', '=', 'FuseMove')]"})
+        self.env['fuse.node'].create({'name': 'Attachments',
+                                      'type': 'file',
+                                      'parent_id': node1.id,
+                                      'parent_field_id': self.env.ref('base.field_ir_attachment__res_id').id,
+                                      'model_id': self.env.ref('base.model_ir_attachment').id,
+                                      'bin_field': self.env.ref('base.field_ir_attachment__datas').id,
+                                      'file_content': 'bin',
+                                      'field_value_ids': [(0, 0, {
+                                          'field_id': self.env.ref('base.field_ir_attachment__res_model').id,
+                                          'field_value': "'res.partner'"})]})
+        partner1 = self.env['res.partner'].create({'name': 'MovePartner1', 'ref': 'FuseMove'})
+        partner2 = self.env['res.partner'].create({'name': 'MovePartner2', 'ref': 'FuseMove'})
+        attachment1 = self.env['ir.attachment'].create({'name': 'report.pdf', 'res_model': 'res.partner',
+                                                        'res_id': partner1.id, 'datas': base64.b64encode(b'123')})
+
+        # The name does not match name_re_pattern, the record is only moved
+        err1 = self.env['fuse.node'].rename('/MovePartner1/report.pdf', '/MovePartner2/report.pdf')
+        self.assertEqual(err1, 0)
+        self.assertEqual(attachment1.res_id, partner2.id)
+        self.assertEqual(attachment1.name, 'report.pdf')
+
+        # Move and rename
+        err1 = self.env['fuse.node'].rename('/MovePartner2/report.pdf', '/MovePartner1/Report')
+        self.assertEqual(err1, 0)
+        self.assertEqual(attachment1.res_id, partner1.id)
+        self.assertEqual(attachment1.name, 'Report')
+
+        # Records cannot become directories of another model
+        err1 = self.env['fuse.node'].rename('/MovePartner1/Report', '/MovePartner3')
+        self.assertEqual(err1, errno.EACCES)
+
+
+class FuseContentTesting(HttpCase):
+    def test_content(self):
+        self.env['fuse.node'].create({'name': 'Test3',
+                                      'type': 'file',
+                                      'parent_id': self.env.ref('fuse.root_node').id,
+                                      'model_id': self.env.ref('base.model_ir_attachment').id,
+                                      'bin_field': self.env.ref('base.field_ir_attachment__datas').id,
+                                      'file_content': 'bin'})
+        attachment1 = self.env['ir.attachment'].create({'name': 'TestAttach2', 'datas': base64.b64encode(b'123456789')})
+        self.authenticate('admin', 'admin')
+
+        response = self.url_open('/fuse/content/TestAttach2', headers={'Range': 'bytes=2-4'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'345')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 2-4/9')
+
+        response = self.url_open('/fuse/content/TestAttach2', headers={'If-None-Match': f'"{attachment1.checksum}"'})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.url_open('/fuse/content/Missing')
+        self.assertEqual(response.status_code, 404)
+
+    def test_upload_chunks(self):
+        # The client uploads over HTTP in chunk_size pieces and continues at the returned offset
+        self.env['fuse.node'].create({'name': 'Test3',
+                                      'type': 'file',
+                                      'parent_id': self.env.ref('fuse.root_node').id,
+                                      'model_id': self.env.ref('base.model_ir_attachment').id,
+                                      'bin_field': self.env.ref('base.field_ir_attachment__datas').id,
+                                      'file_content': 'bin'})
+        attachment1 = self.env['ir.attachment'].create({'name': 'TestAttach3', 'datas': base64.b64encode(b'123')})
+        self.authenticate('admin', 'admin')
+        fuse = self.env['fuse.node'].with_user(self.env.ref('base.user_admin'))
+        data = b'0123456789'
+        session = fuse.upload_begin('/TestAttach3', len(data), 12.0)
+        offset = session['offset']
+        while offset < len(data):
+            response = self.url_open(f"/fuse/upload/{session['token']}?offset={offset}", data=data[offset:offset + 4])
+            result = response.json()
+            self.assertEqual(result['errno'], 0)
+            self.assertIsInstance(result['offset'], int)
+            offset = result['offset']
+        self.assertEqual(offset, len(data))
+        self.assertEqual(fuse.upload_commit(session['token']), 0)
+        self.assertEqual(base64.b64decode(attachment1.datas), data)